@@ -36,6 +36,10 @@ class MicrosoftSSOInlineAdmin(admin.StackedInline):
     readonly_fields = ("microsoft_id", "picture", "user_principal_name")
     extra = 0
 
+    def get_queryset(self, request):
+        # The picture blob is loaded only when the picture is rendered
+        return super().get_queryset(request).defer("picture_raw")
+
     def has_add_permission(self, request, obj):
         return False
 
@@ -50,8 +54,13 @@ if admin.site.is_registered(CurrentUserModel):
 @admin.register(MicrosoftSSOUser)
 class MicrosoftSSOAdmin(admin.ModelAdmin):
     list_display = ("user", "microsoft_id")
+    list_select_related = ("user",)
     readonly_fields = ("microsoft_id", "picture", "user_principal_name")
 
+    def get_queryset(self, request):
+        # The picture blob is loaded only when the picture is rendered
+        return super().get_queryset(request).defer("picture_raw")
+
     def has_add_permission(self, request):
         return False
 
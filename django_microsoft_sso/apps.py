@@ -1,4 +1,7 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import gettext_lazy as _
 
 
@@ -8,4 +11,32 @@ class DjangoMicrosoftSsoConfig(AppConfig):
     verbose_name = _("Microsoft SSO User")
 
     def ready(self):
+        import django_microsoft_sso.checks.hooks  # noqa
         import django_microsoft_sso.templatetags  # noqa
+        from django_microsoft_sso.registry import (
+            hook_registry,
+            provider_registry,
+            reload_hooks,
+            reload_providers,
+        )
+        from django_microsoft_sso.signals import clear_superuser_exists_cache
+
+        # Import errors are reported by the checks.hooks system check
+        hook_registry.load()
+        setting_changed.connect(reload_hooks, dispatch_uid="django_microsoft_sso_hooks")
+        provider_registry.load()
+        setting_changed.connect(
+            reload_providers, dispatch_uid="django_microsoft_sso_providers"
+        )
+
+        user_model = get_user_model()
+        post_save.connect(
+            clear_superuser_exists_cache,
+            sender=user_model,
+            dispatch_uid="django_microsoft_sso_superuser_post_save",
+        )
+        post_delete.connect(
+            clear_superuser_exists_cache,
+            sender=user_model,
+            dispatch_uid="django_microsoft_sso_superuser_post_delete",
+        )
@@ -0,0 +1,20 @@
+from django.core.checks import Error, register
+
+
+@register()
+def check_hooks(app_configs, **kwargs):
+    """Check if the hook and backend paths in settings can be imported.
+
+    Errors use the id `microsoft_sso.E001`. Callable settings are
+    resolved on each request, so they are not checked here.
+    """
+    from django_microsoft_sso.registry import hook_registry
+
+    return [
+        Error(
+            msg=f"{setting_name} cannot be imported: '{path}'.",
+            hint=f"Check the dotted path. Error: {error.__cause__ or error}",
+            id="microsoft_sso.E001",
+        )
+        for setting_name, path, error in hook_registry.load()
+    ]
@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+import msal
+import requests
+from django.core.cache import caches
+from loguru import logger
+from msal import ConfidentialClientApplication
+from msal.authority import AuthorityBuilder
+from requests.adapters import HTTPAdapter
+
+from django_microsoft_sso import conf
+
+# Process-wide resources, shared by all requests.
+# They are created on first use, and created again after a fork,
+# so workers never share connections with their parent process.
+_http_client: httpx.Client | None = None
+_http_client_pid: int | None = None
+_graph_executor: ThreadPoolExecutor | None = None
+_graph_executor_pid: int | None = None
+_graph_slots: threading.BoundedSemaphore | None = None
+_discovery_executor: ThreadPoolExecutor | None = None
+_discovery_executor_pid: int | None = None
+_async_http_clients: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, tuple[httpx.AsyncClient, Any]
+] = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+_msal_apps: OrderedDict[tuple, ConfidentialClientApplication] = OrderedDict()
+_msal_lock = threading.Lock()
+
+
+def _get_http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=conf.MICROSOFT_SSO_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=conf.MICROSOFT_SSO_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=conf.MICROSOFT_SSO_HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """Get the shared HTTP Client used for Microsoft Graph calls.
+
+    Connections are kept alive between requests, so a busy worker
+    reuses warm connections to graph.microsoft.com instead of doing
+    a new TLS handshake on every call. Pool limits come from the
+    MICROSOFT_SSO_HTTP_* settings. Timeouts are set on each call.
+    """
+    global _http_client, _http_client_pid
+    with _lock:
+        if _http_client is None or _http_client_pid != os.getpid():
+            _http_client = httpx.Client(limits=_get_http_limits())
+            _http_client_pid = os.getpid()
+    return _http_client
+
+
+def close_http_client() -> None:
+    global _http_client
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+        _http_client = None
+
+
+async def _close_on_loop_shutdown(client: httpx.AsyncClient):
+    """Close the client when its event loop shuts down.
+
+    asyncio.run (also used by async_to_sync) finalizes the running
+    async generators before closing the loop, so the "finally" runs
+    while the loop can still close the connections.
+    """
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Get the shared async HTTP Client for the running event loop.
+
+    Async clients are bound to the event loop which created them,
+    so we keep one client per loop, closed when the loop shuts down.
+    """
+    loop = asyncio.get_running_loop()
+    cached = _async_http_clients.get(loop)
+    if cached is None:
+        client = httpx.AsyncClient(limits=_get_http_limits())
+        closer = _close_on_loop_shutdown(client)
+        asyncio.ensure_future(closer.__anext__())
+        cached = _async_http_clients[loop] = (client, closer)
+    return cached[0]
+
+
+def get_graph_max_workers() -> int:
+    """Get the thread pool size for parallel Graph calls.
+
+    Uses MICROSOFT_SSO_GRAPH_MAX_WORKERS, or the ThreadPoolExecutor default.
+    """
+    return conf.MICROSOFT_SSO_GRAPH_MAX_WORKERS or min(32, (os.cpu_count() or 1) + 4)
+
+
+def get_graph_executor() -> ThreadPoolExecutor:
+    """Get the shared thread pool for parallel Graph calls.
+
+    Threads don't survive a fork, so each worker process creates its own pool.
+    """
+    global _graph_executor, _graph_executor_pid, _graph_slots
+    with _lock:
+        if _graph_executor is None or _graph_executor_pid != os.getpid():
+            max_workers = get_graph_max_workers()
+            _graph_executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="microsoft_sso_graph"
+            )
+            _graph_slots = threading.BoundedSemaphore(max_workers)
+            _graph_executor_pid = os.getpid()
+    return _graph_executor
+
+
+def submit_graph_call(fn, *args) -> Future:
+    """Run the Graph call in the shared pool, if a worker is free.
+
+    When all workers are busy, the call runs right away in the current thread,
+    so it never waits in the pool queue while its timeout runs out.
+    """
+    executor = get_graph_executor()
+    slots = _graph_slots
+    if slots.acquire(blocking=False):
+        future = executor.submit(fn, *args)
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as error:
+        future.set_exception(error)
+    return future
+
+
+def get_discovery_executor() -> ThreadPoolExecutor:
+    """Get the thread pool for background discovery document refreshes.
+
+    Kept apart from the Graph pool, so refreshes never take a worker
+    from a login.
+    """
+    global _discovery_executor, _discovery_executor_pid
+    with _lock:
+        if _discovery_executor is None or _discovery_executor_pid != os.getpid():
+            _discovery_executor = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="microsoft_sso_discovery"
+            )
+            _discovery_executor_pid = os.getpid()
+    return _discovery_executor
+
+
+DISCOVERY_PATHS = ("/.well-known/openid-configuration", "/common/discovery/instance")
+
+
+@dataclass
+class CachedResponse:
+    """The minimal Response interface MSAL uses for discovery documents."""
+
+    text: str
+    status_code: int = 200
+    headers: dict[str, str] = field(default_factory=dict)
+
+    def raise_for_status(self):
+        pass
+
+
+class DiscoveryCacheHttpClient:
+    """HTTP Client for MSAL which keeps discovery documents in Django cache.
+
+    Authority (tenant) discovery and OpenID configuration documents almost
+    never change, so a freshly forked worker can read them from the cache
+    instead of calling login.microsoftonline.com on its first login.
+
+    Documents are fresh for MICROSOFT_SSO_DISCOVERY_CACHE_TTL seconds. After
+    that, and for MICROSOFT_SSO_DISCOVERY_CACHE_STALE_TTL seconds more, the
+    stale document is returned while a new one is downloaded in background.
+    All other requests go straight to the wrapped client.
+    """
+
+    def __init__(self, http_client: requests.Session | None = None):
+        if http_client is None:
+            # Same defaults MSAL uses when no client is provided
+            http_client = requests.Session()
+            adapter = HTTPAdapter(max_retries=1)
+            http_client.mount("http://", adapter)
+            http_client.mount("https://", adapter)
+        self._http_client = http_client
+
+    @staticmethod
+    def get_cache_key(url: str, params: dict | None) -> str:
+        raw_key = f"{url}?{sorted((params or {}).items())}"
+        return (
+            f"django_microsoft_sso:discovery:{hashlib.sha256(raw_key.encode()).hexdigest()}"
+        )
+
+    def get(self, url: str, params: dict | None = None, **kwargs):
+        ttl = conf.MICROSOFT_SSO_DISCOVERY_CACHE_TTL
+        if not ttl or not url.split("?")[0].endswith(DISCOVERY_PATHS):
+            return self._http_client.get(url, params=params, **kwargs)
+
+        cache = caches[conf.MICROSOFT_SSO_DISCOVERY_CACHE_ALIAS]
+        key = self.get_cache_key(url, params)
+        cached = cache.get(key)
+        if cached is None:
+            return self._download(url, params, kwargs, key)
+
+        if time.time() - cached["stored_at"] > ttl and cache.add(
+            f"{key}:refreshing", True, timeout=60
+        ):
+            logger.debug(f"Discovery document is stale. Refreshing: {url}")
+            get_discovery_executor().submit(self._download, url, params, kwargs, key)
+        return CachedResponse(text=cached["text"])
+
+    def _download(self, url: str, params: dict | None, kwargs: dict, key: str):
+        response = self._http_client.get(url, params=params, **kwargs)
+        if response.status_code == 200:
+            cache = caches[conf.MICROSOFT_SSO_DISCOVERY_CACHE_ALIAS]
+            ttl = conf.MICROSOFT_SSO_DISCOVERY_CACHE_TTL
+            stale_ttl = conf.MICROSOFT_SSO_DISCOVERY_CACHE_STALE_TTL
+            cache.set(
+                key, {"text": response.text, "stored_at": time.time()}, ttl + stale_ttl
+            )
+            cache.delete(f"{key}:refreshing")
+        return response
+
+    def post(self, url: str, **kwargs):
+        return self._http_client.post(url, **kwargs)
+
+    def close(self):
+        self._http_client.close()
+
+
+class _NoTokenCache(msal.TokenCache):
+    """Token Cache which does not keep tokens.
+
+    The MSAL apps are shared between users, and this library never
+    acquires tokens silently, so there is no reason to keep
+    every user token in memory.
+    """
+
+    def add(self, event, now=None):
+        pass
+
+
+def _credential_fingerprint(client_credential: Any) -> str:
+    return hashlib.sha256(repr(client_credential).encode()).hexdigest()
+
+
+def get_msal_app(
+    client_id: str,
+    client_credential: Any,
+    authority: str | AuthorityBuilder | None,
+) -> ConfidentialClientApplication:
+    """Get a MSAL ConfidentialClientApplication from the process registry.
+
+    Building the app can trigger authority and instance discovery over the
+    network, so we keep the last MICROSOFT_SSO_MSAL_CACHE_SIZE apps, keyed by
+    client id, authority and a fingerprint of the credential. Because the key
+    uses the resolved values, per-request callables for these settings
+    still work.
+    """
+    key = (
+        client_id,
+        str(authority) if authority is not None else None,
+        _credential_fingerprint(client_credential),
+    )
+    with _msal_lock:
+        app = _msal_apps.get(key)
+        if app is not None:
+            _msal_apps.move_to_end(key)
+            return app
+
+    # Build outside the lock, so a slow discovery does not block other logins.
+    app = msal.ConfidentialClientApplication(
+        client_id=client_id,
+        client_credential=client_credential,
+        authority=authority,
+        token_cache=_NoTokenCache(),
+        http_client=DiscoveryCacheHttpClient(),
+    )
+    with _msal_lock:
+        app = _msal_apps.setdefault(key, app)
+        _msal_apps.move_to_end(key)
+        while len(_msal_apps) > conf.MICROSOFT_SSO_MSAL_CACHE_SIZE:
+            _msal_apps.popitem(last=False)
+    return app
+
+
+def clear_msal_apps() -> None:
+    with _msal_lock:
+        _msal_apps.clear()
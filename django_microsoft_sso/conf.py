@@ -40,6 +40,70 @@ class MicrosoftSSOSettings:
     def SSO_USE_ALTERNATE_W003(self) -> bool:
         return self._get_setting("SSO_USE_ALTERNATE_W003", False, accept_callable=False)
 
+    @property
+    def MICROSOFT_SSO_USE_ASYNC_VIEWS(self) -> bool:
+        return self._get_setting(
+            "MICROSOFT_SSO_USE_ASYNC_VIEWS", False, accept_callable=False
+        )
+
+    @property
+    def MICROSOFT_SSO_HTTP_MAX_CONNECTIONS(self) -> int:
+        return self._get_setting(
+            "MICROSOFT_SSO_HTTP_MAX_CONNECTIONS", 100, accept_callable=False
+        )
+
+    @property
+    def MICROSOFT_SSO_HTTP_MAX_KEEPALIVE_CONNECTIONS(self) -> int:
+        return self._get_setting(
+            "MICROSOFT_SSO_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20, accept_callable=False
+        )
+
+    @property
+    def MICROSOFT_SSO_HTTP_KEEPALIVE_EXPIRY(self) -> float:
+        return self._get_setting(
+            "MICROSOFT_SSO_HTTP_KEEPALIVE_EXPIRY", 30.0, accept_callable=False
+        )
+
+    @property
+    def MICROSOFT_SSO_GRAPH_MAX_WORKERS(self) -> int | None:
+        return self._get_setting(
+            "MICROSOFT_SSO_GRAPH_MAX_WORKERS", None, accept_callable=False
+        )
+
+    @property
+    def MICROSOFT_SSO_MSAL_CACHE_SIZE(self) -> int:
+        return self._get_setting("MICROSOFT_SSO_MSAL_CACHE_SIZE", 32, accept_callable=False)
+
+    @property
+    def MICROSOFT_SSO_DISCOVERY_CACHE_ALIAS(self) -> str:
+        return self._get_setting(
+            "MICROSOFT_SSO_DISCOVERY_CACHE_ALIAS", "default", accept_callable=False
+        )
+
+    @property
+    def MICROSOFT_SSO_DISCOVERY_CACHE_TTL(self) -> int:
+        return self._get_setting(
+            "MICROSOFT_SSO_DISCOVERY_CACHE_TTL", 86400, accept_callable=False
+        )
+
+    @property
+    def MICROSOFT_SSO_DISCOVERY_CACHE_STALE_TTL(self) -> int:
+        return self._get_setting(
+            "MICROSOFT_SSO_DISCOVERY_CACHE_STALE_TTL", 604800, accept_callable=False
+        )
+
+    @property
+    def MICROSOFT_SSO_PICTURE_STORAGE(self) -> str | None:
+        return self._get_setting(
+            "MICROSOFT_SSO_PICTURE_STORAGE", None, accept_callable=False
+        )
+
+    @property
+    def MICROSOFT_SSO_PERMISSION_LOADER(self) -> str | None:
+        return self._get_setting(
+            "MICROSOFT_SSO_PERMISSION_LOADER", None, accept_callable=False
+        )
+
     # Configurations with optional callable
 
     @property
@@ -197,6 +261,42 @@ class MicrosoftSSOSettings:
     def MICROSOFT_SSO_GRAPH_TIMEOUT(self) -> int | Callable[[HttpRequest], int]:
         return self._get_setting("MICROSOFT_SSO_GRAPH_TIMEOUT", 10)
 
+    @property
+    def MICROSOFT_SSO_GRAPH_USER_FIELDS(
+        self,
+    ) -> list[str] | None | Callable[[HttpRequest], list[str] | None]:
+        return self._get_setting(
+            "MICROSOFT_SSO_GRAPH_USER_FIELDS",
+            [
+                "id",
+                "mail",
+                "userPrincipalName",
+                "givenName",
+                "surname",
+                "preferredLanguage",
+            ],
+        )
+
+    @property
+    def MICROSOFT_SSO_PICTURE_SIZE(
+        self,
+    ) -> str | None | Callable[[HttpRequest], str | None]:
+        return self._get_setting("MICROSOFT_SSO_PICTURE_SIZE", None)
+
+    @property
+    def MICROSOFT_SSO_PICTURE_FORMAT(
+        self,
+    ) -> str | None | Callable[[HttpRequest], str | None]:
+        return self._get_setting("MICROSOFT_SSO_PICTURE_FORMAT", None)
+
+    @property
+    def MICROSOFT_SSO_PICTURE_QUALITY(self) -> int | Callable[[HttpRequest], int]:
+        return self._get_setting("MICROSOFT_SSO_PICTURE_QUALITY", 80)
+
+    @property
+    def MICROSOFT_SSO_GRAPH_FETCH_MODE(self) -> str | Callable[[HttpRequest], str]:
+        return self._get_setting("MICROSOFT_SSO_GRAPH_FETCH_MODE", "sequential")
+
     @property
     def SSO_ADMIN_ROUTE(
         self,
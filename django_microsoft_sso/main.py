@@ -1,15 +1,24 @@
+import asyncio
+import hashlib
+import time
 import uuid
-from dataclasses import dataclass
+from base64 import b64decode
+from concurrent.futures import wait
+from dataclasses import dataclass, field
+from functools import cached_property, partial
 from typing import Any
 from urllib.parse import urlparse
 
 import httpx
-import msal
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
 from django.contrib.sites.shortcuts import get_current_site
-from django.db.models import Field, Q
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.db.models import Field
 from django.http import HttpRequest
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -18,10 +27,44 @@ from msal import ConfidentialClientApplication
 from msal.authority import AuthorityBuilder
 
 from django_microsoft_sso import conf
+from django_microsoft_sso.clients import (
+    get_async_http_client,
+    get_http_client,
+    get_msal_app,
+    submit_graph_call,
+)
+from django_microsoft_sso.matchers import (
+    PermissionIndex,
+    get_domain_matcher,
+    get_permission_index,
+)
 from django_microsoft_sso.models import MicrosoftSSOUser
+from django_microsoft_sso.pictures import (
+    delete_unused_pictures,
+    get_picture_storage,
+    guess_content_type,
+    process_picture,
+    save_picture,
+)
+from django_microsoft_sso.registry import hook_registry
+from django_microsoft_sso.signals import SUPERUSER_EXISTS_CACHE_KEY
 
 STATE = str(uuid.uuid4())
 
+GRAPH_API_URL = "https://graph.microsoft.com/v1.0"
+GRAPH_DEFAULT_SCOPE = "https://graph.microsoft.com/.default"
+GRAPH_FETCH_MODES = ("sequential", "parallel", "batch")
+
+
+@dataclass
+class GraphOptions:
+    headers: dict[str, str]
+    timeout: float
+    fetch_mode: str
+    me_path: str
+    picture_size: str | None = None
+    stored_etag: str | None = None
+
 
 @dataclass
 class MicrosoftAuth:
@@ -49,6 +92,10 @@ class MicrosoftAuth:
 
         MICROSOFT_SSO_APPLICATION_ID = get_client_id
 
+        Callables are called once per request: the result is stored in the
+        request, and shared by all MicrosoftAuth and UserHelper instances
+        using the same request.
+
         :param key: The key to retrieve from the settings.
         :return: The value associated with the key.
         :raises ValueError: If the key is not found in the settings.
@@ -57,13 +104,26 @@ class MicrosoftAuth:
         if hasattr(conf, microsoft_sso_conf):
             value = getattr(conf, microsoft_sso_conf)
             if callable(value):
+                request_cache = self.get_request_cache()
+                cached = request_cache.get(microsoft_sso_conf)
+                if cached is not None and cached[0] is value:
+                    return cached[1]
                 logger.debug(
                     f"Value from conf {microsoft_sso_conf} is a callable. Calling it."
                 )
-                return value(self.request)
+                result = value(self.request)
+                request_cache[microsoft_sso_conf] = (value, result)
+                return result
             return value
         raise ValueError(f"SSO Configuration '{microsoft_sso_conf}' not found in settings.")
 
+    def get_request_cache(self) -> dict[str, tuple[Any, Any]]:
+        if self.request is None:
+            return {}
+        if not hasattr(self.request, "_microsoft_sso_settings_cache"):
+            self.request._microsoft_sso_settings_cache = {}
+        return self.request._microsoft_sso_settings_cache
+
     @property
     def scopes(self) -> list[str]:
         return self.get_sso_value("SCOPES")
@@ -96,7 +156,7 @@ class MicrosoftAuth:
     def auth(self) -> ConfidentialClientApplication:
         if not self._auth:
             authority = self.get_authority()
-            self._auth = msal.ConfidentialClientApplication(
+            self._auth = get_msal_app(
                 client_id=self.get_sso_value("APPLICATION_ID"),
                 client_credential=self.get_sso_value("CLIENT_SECRET"),
                 authority=authority,
@@ -122,30 +182,385 @@ class MicrosoftAuth:
                 )
         return authority
 
-    def get_user_info(self):
-        graph_url = "https://graph.microsoft.com/v1.0/me"
+    def get_graph_user_fields(self) -> list[str]:
+        """Get the user properties to retrieve from Microsoft Graph `/me`.
+
+        These are the MICROSOFT_SSO_GRAPH_USER_FIELDS values plus the fields
+        declared by the pre-validate and pre-create hooks, in a `graph_fields`
+        attribute:
+
+        def pre_create_user(ms_user_info, request):
+            return {"job_title": ms_user_info.get("jobTitle")}
+
+        pre_create_user.graph_fields = ["jobTitle"]
+
+        :return: The field list, or an empty list to use the Graph default set.
+        """
+        fields = self.get_sso_value("GRAPH_USER_FIELDS")
+        if not fields:
+            return []
+        fields = list(fields)
+        for hook_conf in ["PRE_VALIDATE_CALLBACK", "PRE_CREATE_CALLBACK"]:
+            try:
+                hook = hook_registry.get_hook(hook_conf, self)
+            except ImportError:
+                logger.debug(f"Cannot import {hook_conf} to read its graph_fields.")
+                continue
+            fields += getattr(hook, "graph_fields", [])
+        return list(dict.fromkeys(fields))
+
+    def get_graph_options(self) -> GraphOptions:
+        """Get the options for Microsoft Graph requests.
+
+        :raises ValueError: If MICROSOFT_SSO_GRAPH_FETCH_MODE is not valid.
+        """
         token = self.token_info["access_token"]
-        headers = {"Authorization": f"Bearer {token}"}
-        graph_timeout = self.get_sso_value("GRAPH_TIMEOUT")
-        response = httpx.get(graph_url, headers=headers, timeout=graph_timeout)
+        fetch_mode = self.get_sso_value("GRAPH_FETCH_MODE")
+        if fetch_mode not in GRAPH_FETCH_MODES:
+            raise ValueError(
+                f"MICROSOFT_SSO_GRAPH_FETCH_MODE must be one of: "
+                f"{', '.join(GRAPH_FETCH_MODES)}"
+            )
+        user_fields = self.get_graph_user_fields()
+        return GraphOptions(
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=self.get_sso_value("GRAPH_TIMEOUT"),
+            fetch_mode=fetch_mode,
+            me_path=f"/me?$select={','.join(user_fields)}" if user_fields else "/me",
+            picture_size=self.get_sso_value("PICTURE_SIZE"),
+            stored_etag=self.get_stored_picture_etag(),
+        )
+
+    def get_user_info(self):
+        """Get User Info from Microsoft Graph.
+
+        First we retrieve the user profile from `/me`. Then we retrieve the
+        `mailVerified` flag and the user picture, one after another
+        or at the same time, depending on the MICROSOFT_SSO_GRAPH_FETCH_MODE
+        setting. On "parallel" mode, MICROSOFT_SSO_GRAPH_TIMEOUT covers all
+        three requests. On "batch" mode, all three requests are sent in a
+        single JSON batch request.
+
+        :return: The user info dict, with `email_verified` and
+            `picture_raw_data` keys added when available.
+        """
+        options = self.get_graph_options()
+        deadline = time.monotonic() + options.timeout
+
+        if options.fetch_mode == "batch":
+            response = get_http_client().post(
+                f"{GRAPH_API_URL}/$batch",
+                json=self._get_batch_payload(options),
+                headers=options.headers,
+                timeout=options.timeout,
+            )
+            user_info, retry_ids = self._parse_batch(response, options)
+            if user_info is not None:
+                if "email_verified" in retry_ids:
+                    user_info.update(
+                        self._get_email_verified(user_info, options, options.timeout)
+                    )
+                if "picture" in retry_ids:
+                    user_info.update(self._get_picture(options, options.timeout))
+                return user_info
+
+        response = get_http_client().get(
+            f"{GRAPH_API_URL}{options.me_path}",
+            headers=options.headers,
+            timeout=options.timeout,
+        )
         user_info = response.json()
         response.raise_for_status()
 
-        # Get Email Verified Flag
-        graph_url = "https://graph.microsoft.com/v1.0/users/{}?$select=mailVerified".format(
-            user_info["id"]
+        if options.fetch_mode == "parallel":
+            user_info.update(self._get_extra_info_in_parallel(user_info, options, deadline))
+        else:
+            user_info.update(self._get_email_verified(user_info, options, options.timeout))
+            user_info.update(self._get_picture(options, options.timeout))
+
+        return user_info
+
+    async def aget_user_info(self):
+        """Async version of get_user_info, using the async HTTP Client.
+
+        On "parallel" mode, the follow-up requests run concurrently
+        on the event loop, instead of a thread pool.
+        """
+        options = await sync_to_async(self.get_graph_options)()
+        deadline = time.monotonic() + options.timeout
+        client = get_async_http_client()
+
+        if options.fetch_mode == "batch":
+            response = await client.post(
+                f"{GRAPH_API_URL}/$batch",
+                json=self._get_batch_payload(options),
+                headers=options.headers,
+                timeout=options.timeout,
+            )
+            user_info, retry_ids = self._parse_batch(response, options)
+            if user_info is not None:
+                if "email_verified" in retry_ids:
+                    user_info.update(
+                        await self._aget_email_verified(user_info, options, options.timeout)
+                    )
+                if "picture" in retry_ids:
+                    user_info.update(await self._aget_picture(options, options.timeout))
+                return user_info
+
+        response = await client.get(
+            f"{GRAPH_API_URL}{options.me_path}",
+            headers=options.headers,
+            timeout=options.timeout,
         )
-        response = httpx.get(graph_url, headers=headers, timeout=graph_timeout)
+        user_info = response.json()
+        response.raise_for_status()
+
+        if options.fetch_mode == "parallel":
+            remaining = max(deadline - time.monotonic(), 0)
+            try:
+                results = await asyncio.wait_for(
+                    asyncio.gather(
+                        self._aget_email_verified(user_info, options, remaining),
+                        self._aget_picture(options, remaining),
+                    ),
+                    timeout=remaining,
+                )
+            except TimeoutError as error:
+                raise TimeoutError(
+                    "Microsoft Graph requests exceeded MICROSOFT_SSO_GRAPH_TIMEOUT."
+                ) from error
+            for result in results:
+                user_info.update(result)
+        else:
+            user_info.update(
+                await self._aget_email_verified(user_info, options, options.timeout)
+            )
+            user_info.update(await self._aget_picture(options, options.timeout))
+
+        return user_info
+
+    def _get_batch_payload(self, options: GraphOptions) -> dict:
+        return {
+            "requests": [
+                {"id": "me", "method": "GET", "url": options.me_path},
+                {
+                    "id": "email_verified",
+                    "method": "GET",
+                    "url": "/me?$select=mailVerified",
+                },
+                {
+                    "id": "picture",
+                    "method": "GET",
+                    "url": self._get_picture_url(options.picture_size).removeprefix(
+                        GRAPH_API_URL
+                    ),
+                    "headers": self._get_picture_headers({}, options.stored_etag),
+                },
+            ]
+        }
+
+    @staticmethod
+    def _get_batch_item_response(item: dict) -> httpx.Response:
+        """Convert a JSON batch sub-response to a httpx Response.
+
+        JSON bodies are returned as objects, and binary bodies, like
+        the user picture, as base64 strings.
+        """
+        headers = item.get("headers", {})
+        body = item.get("body")
+        content_type = headers.get("Content-Type", "")
+        if body is None:
+            return httpx.Response(item["status"], headers=headers)
+        if content_type.startswith("application/json") or not isinstance(body, str):
+            return httpx.Response(item["status"], headers=headers, json=body)
+        return httpx.Response(item["status"], headers=headers, content=b64decode(body))
+
+    def _parse_batch(
+        self, response: httpx.Response, options: GraphOptions
+    ) -> tuple[dict | None, list[str]]:
+        """Read the JSON batch response.
+
+        Sub-requests which failed with a transient error (429 or 5xx)
+        must be requested again, in separate calls.
+
+        :return: The user info, or None if the batch or the `/me` request
+            failed, and the ids of the sub-requests to request again.
+        """
+        if response.status_code != 200:
+            logger.warning(
+                f"Microsoft Graph batch request failed ({response.status_code}). "
+                f"Using separate requests."
+            )
+            return None, []
+
+        items = {
+            item["id"]: self._get_batch_item_response(item)
+            for item in response.json().get("responses", [])
+        }
+        me_response = items.get("me")
+        if me_response is None or me_response.status_code >= 400:
+            logger.warning("Microsoft Graph batch request failed for /me.")
+            return None, []
+
+        user_info = me_response.json()
+        retry_ids = []
+        for item_id, parse in [
+            ("email_verified", self._parse_email_verified),
+            ("picture", partial(self._parse_picture, stored_etag=options.stored_etag)),
+        ]:
+            item_response = items.get(item_id)
+            if (
+                item_response is None
+                or item_response.status_code == 429
+                or item_response.status_code >= 500
+                # Picture size not available: request the full picture
+                or (
+                    item_id == "picture"
+                    and item_response.status_code == 404
+                    and options.picture_size
+                )
+            ):
+                retry_ids.append(item_id)
+            else:
+                user_info.update(parse(item_response))
+        return user_info, retry_ids
+
+    @staticmethod
+    def _get_email_verified_url(user_info: dict) -> str:
+        return f"{GRAPH_API_URL}/users/{user_info['id']}?$select=mailVerified"
+
+    @staticmethod
+    def _parse_email_verified(response: httpx.Response) -> dict:
         if response.status_code == 200:
-            user_info.update({"email_verified": response.json().get("mailVerified", False)})
+            return {"email_verified": response.json().get("mailVerified", False)}
+        return {}
+
+    @staticmethod
+    def _get_picture_url(picture_size: str | None = None) -> str:
+        if picture_size:
+            return f"{GRAPH_API_URL}/me/photos/{picture_size}/$value"
+        return f"{GRAPH_API_URL}/me/photo/$value"
+
+    @staticmethod
+    def _get_picture_headers(headers: dict, stored_etag: str | None) -> dict:
+        if stored_etag:
+            return {**headers, "If-None-Match": stored_etag}
+        return headers
+
+    @staticmethod
+    def _parse_picture(response: httpx.Response, stored_etag: str | None = None) -> dict:
+        """Read the picture response.
 
-        # Get Picture Data
-        graph_url = "https://graph.microsoft.com/v1.0/me/photo/$value"
-        response = httpx.get(graph_url, headers=headers, timeout=graph_timeout)
+        The picture version is the ETag header sent by Microsoft,
+        or the picture hash, when not available.
+
+        :return: The picture data and version. `picture_not_modified` is True
+            if the picture is the same we have on database.
+        """
+        if response.status_code == 304:
+            return {"picture_etag": stored_etag, "picture_not_modified": True}
         if response.status_code == 200:
-            user_info.update({"picture_raw_data": response.content})
+            etag = (
+                response.headers.get("ETag") or hashlib.sha256(response.content).hexdigest()
+            )
+            return {
+                "picture_raw_data": response.content,
+                "picture_etag": etag,
+                "picture_not_modified": etag == stored_etag,
+            }
+        return {}
 
-        return user_info
+    def get_stored_picture_etag(self) -> str | None:
+        """Get the picture version saved on the last login, for If-None-Match.
+
+        The user is found by the `oid` claim of the ID Token, which is the same
+        as the Microsoft Graph user id, so the ETag is known before any Graph call.
+        """
+        if not self.get_sso_value("SAVE_BASIC_MICROSOFT_INFO"):
+            return None
+        microsoft_id = (self.token_info.get("id_token_claims") or {}).get("oid")
+        if not microsoft_id:
+            return None
+        return (
+            MicrosoftSSOUser.objects.filter(microsoft_id=microsoft_id)
+            .values_list("picture_etag", flat=True)
+            .first()
+        )
+
+    def _get_email_verified(
+        self, user_info: dict, options: GraphOptions, timeout: float
+    ) -> dict:
+        response = get_http_client().get(
+            self._get_email_verified_url(user_info),
+            headers=options.headers,
+            timeout=timeout,
+        )
+        return self._parse_email_verified(response)
+
+    def _get_picture(self, options: GraphOptions, timeout: float) -> dict:
+        headers = self._get_picture_headers(options.headers, options.stored_etag)
+        response = get_http_client().get(
+            self._get_picture_url(options.picture_size), headers=headers, timeout=timeout
+        )
+        if response.status_code == 404 and options.picture_size:
+            # Picture size not available: request the full picture
+            response = get_http_client().get(
+                self._get_picture_url(), headers=headers, timeout=timeout
+            )
+        return self._parse_picture(response, options.stored_etag)
+
+    async def _aget_email_verified(
+        self, user_info: dict, options: GraphOptions, timeout: float
+    ) -> dict:
+        response = await get_async_http_client().get(
+            self._get_email_verified_url(user_info),
+            headers=options.headers,
+            timeout=timeout,
+        )
+        return self._parse_email_verified(response)
+
+    async def _aget_picture(self, options: GraphOptions, timeout: float) -> dict:
+        headers = self._get_picture_headers(options.headers, options.stored_etag)
+        client = get_async_http_client()
+        response = await client.get(
+            self._get_picture_url(options.picture_size), headers=headers, timeout=timeout
+        )
+        if response.status_code == 404 and options.picture_size:
+            # Picture size not available: request the full picture
+            response = await client.get(
+                self._get_picture_url(), headers=headers, timeout=timeout
+            )
+        return self._parse_picture(response, options.stored_etag)
+
+    def _get_extra_info_in_parallel(
+        self,
+        user_info: dict,
+        options: GraphOptions,
+        deadline: float,
+    ) -> dict:
+        """Get Email Verified Flag and Picture Data at the same time.
+
+        The picture is downloaded in the shared thread pool, while the
+        Email Verified Flag is read in the current thread. If no pool
+        worker is free, both run here, one after another.
+        Each request gets the time left until the deadline as timeout.
+        If any request fails, the error is raised, same as in sequential mode.
+
+        :raises TimeoutError: If requests do not finish until the deadline.
+        """
+        remaining = max(deadline - time.monotonic(), 0)
+        picture_future = submit_graph_call(self._get_picture, options, remaining)
+        extra_info = self._get_email_verified(
+            user_info, options, max(deadline - time.monotonic(), 0)
+        )
+        done, not_done = wait([picture_future], timeout=max(deadline - time.monotonic(), 0))
+        if not_done:
+            picture_future.cancel()
+            raise TimeoutError(
+                "Microsoft Graph requests exceeded MICROSOFT_SSO_GRAPH_TIMEOUT."
+            )
+        extra_info.update(picture_future.result())
+        return extra_info
 
     def get_auth_uri(self):
         return self.result["auth_uri"]
@@ -161,6 +576,25 @@ class MicrosoftAuth:
             logger.error(f"Error acquiring token: {error}")
         return self.token_info
 
+    def get_app_token(self) -> str:
+        """Get an app-only access token for Microsoft Graph.
+
+        Uses the client credentials flow, with the MICROSOFT_SSO_APPLICATION_ID
+        and MICROSOFT_SSO_CLIENT_SECRET, so no user needs to be logged in.
+
+        :raises ValueError: If Microsoft does not return the token.
+        """
+        result = self.auth.acquire_token_for_client(scopes=[GRAPH_DEFAULT_SCOPE])
+        if "access_token" not in result:
+            raise ValueError(
+                f"Cannot get app token: {result.get('error_description', result)}"
+            )
+        return result["access_token"]
+
+    async def aget_user_token(self):
+        # MSAL has no async API, so the token exchange runs in a thread.
+        return await sync_to_async(self.get_user_token)()
+
     def initiate(
         self, custom_scopes: list[str] | None = None, redirect_uri: str | None = None
     ) -> dict:
@@ -206,6 +640,7 @@ class UserHelper:
     user_info: dict[Any, Any]
     request: Any
     user_changed: bool = False
+    user_changed_fields: set[str] = field(default_factory=set)
 
     @property
     def user_info_email(self) -> str:
@@ -216,6 +651,10 @@ class UserHelper:
     def user_principal_name(self) -> str:
         return self.user_info["userPrincipalName"].lower()
 
+    @cached_property
+    def auth(self) -> MicrosoftAuth:
+        return MicrosoftAuth(self.request)
+
     @property
     def user_model(self) -> type[User]:
         return get_user_model()
@@ -230,91 +669,180 @@ class UserHelper:
 
     @property
     def email_is_valid(self) -> bool:
-        auth = MicrosoftAuth(self.request)
         user_email_domain = self.user_info_email.split("@")[-1]
-        allowable_domains = auth.get_sso_value("ALLOWABLE_DOMAINS")
-        valid_domain = allowable_domains == ["*"]
-        for email_domain in allowable_domains:
-            if user_email_domain in email_domain:
-                valid_domain = True
+        allowable_domains = self.auth.get_sso_value("ALLOWABLE_DOMAINS")
+        valid_domain = get_domain_matcher(allowable_domains).match(user_email_domain)
         email_verified = self.user_info.get("verified_email", None)
         if email_verified is not None and not email_verified:
             logger.debug(f"Email {self.user_info_email} is not verified.")
         return valid_domain
 
     def get_or_create_user(self, extra_users_args: dict | None = None):
+        with transaction.atomic():
+            user, created = self.get_or_create_django_user(extra_users_args)
+
+            self.check_first_super_user(user)
+            self.check_for_update(created, user)
+            if self.user_changed:
+                user.save(update_fields=self.user_changed_fields or None)
+
+            if self.auth.get_sso_value("SAVE_BASIC_MICROSOFT_INFO"):
+                self.save_microsoft_info(user, created)
+
+        return user
+
+    def get_or_create_django_user(
+        self, extra_users_args: dict | None = None
+    ) -> tuple[User, bool]:
+        """Get or create the Django User, with its MicrosoftSSOUser row.
+
+        Returning users are fetched with one query, using select_related.
+        """
         user_defaults = extra_users_args or {}
+        queryset = self.user_model.objects.select_related("microsoftssouser")
 
-        auth = MicrosoftAuth(self.request)
-        if auth.get_sso_value("UNIQUE_EMAIL"):
+        if self.auth.get_sso_value("UNIQUE_EMAIL"):
             if not self.user_info_email:
                 raise ValueError("User email not found in Tenant data.")
             if self.username_field.name not in user_defaults:
                 user_defaults[self.username_field.name] = self.user_principal_name
 
-            user, created = self.user_model.objects.get_or_create(
+            return queryset.get_or_create(
                 **{
                     f"{self.email_field_name}__iexact": self.user_info_email,
                     "defaults": user_defaults,
                 }
             )
-        else:
-            user_defaults[self.email_field_name] = self.user_info_email
 
-            # Find searching User Principal Name in MicrosoftSSOUser
-            # For existing databases prior to this version, this field can be empty
-            query = self.user_model.objects.filter(
-                microsoftssouser__user_principal_name__iexact=self.user_principal_name
-            )
-            if query.exists():
-                user = query.get()
-                created = False
-            else:
-                username = user_defaults.pop(
-                    self.username_field.name, self.user_principal_name
-                )
-                if self.email_field_name not in user_defaults:
-                    user_defaults[self.email_field_name] = self.user_info_email
-                if self.username_field.attname not in user_defaults:
-                    user_defaults[self.username_field.attname] = username
-                query = {
-                    f"{self.username_field.attname}__iexact": username,
-                    "defaults": user_defaults,
-                }
-                user, created = self.user_model.objects.get_or_create(**query)
-
-        self.check_first_super_user(user)
-        self.check_for_update(created, user)
-        if self.user_changed:
-            user.save()
-
-        if auth.get_sso_value("SAVE_BASIC_MICROSOFT_INFO"):
-            MicrosoftSSOUser.objects.update_or_create(
-                user=user,
-                defaults={
-                    "microsoft_id": self.user_info["id"],
-                    "picture_raw": self.user_info.get("picture_raw_data"),
-                    "locale": self.user_info.get("preferredLanguage"),
-                    "user_principal_name": self.user_principal_name,
-                },
-            )
+        user_defaults[self.email_field_name] = self.user_info_email
 
-        return user
+        # Find searching User Principal Name in MicrosoftSSOUser
+        # For existing databases prior to this version, this field can be empty
+        user = queryset.filter(
+            microsoftssouser__user_principal_name=self.user_principal_name
+        ).first()
+        if user:
+            return user, False
+
+        username = user_defaults.pop(self.username_field.name, self.user_principal_name)
+        if self.email_field_name not in user_defaults:
+            user_defaults[self.email_field_name] = self.user_info_email
+        if self.username_field.attname not in user_defaults:
+            user_defaults[self.username_field.attname] = username
+        query = {
+            f"{self.username_field.attname}__iexact": username,
+            "defaults": user_defaults,
+        }
+        return queryset.get_or_create(**query)
+
+    def save_microsoft_info(self, user: User, created: bool) -> MicrosoftSSOUser:
+        """Create or update the MicrosoftSSOUser row for the user.
+
+        Uses the row loaded with the user, so updating it
+        costs a single UPDATE query.
+        """
+        defaults = self.get_microsoft_info_fields()
+        sso_user = None
+        if not created:
+            try:
+                sso_user = user.microsoftssouser
+            except MicrosoftSSOUser.DoesNotExist:
+                pass
+
+        # Rewrite the picture only when it changed
+        picture_etag = self.user_info.get("picture_etag")
+        picture_not_modified = self.user_info.get("picture_not_modified") or (
+            sso_user is not None
+            and picture_etag is not None
+            and picture_etag == sso_user.picture_etag
+        )
+        if not picture_not_modified:
+            defaults.update(self.get_picture_fields())
+
+        if sso_user is None:
+            sso_user = MicrosoftSSOUser.objects.create(user=user, **defaults)
+            user.microsoftssouser = sso_user
+            return sso_user
+
+        old_picture_path = sso_user.picture_path
+        changed_fields = []
+        for field_name, value in defaults.items():
+            current_value = getattr(sso_user, field_name)
+            if isinstance(current_value, memoryview):
+                current_value = current_value.tobytes()
+            if current_value != value:
+                setattr(sso_user, field_name, value)
+                changed_fields.append(field_name)
+        if changed_fields:
+            sso_user.save(update_fields=changed_fields)
+        if old_picture_path and "picture_path" in changed_fields:
+            transaction.on_commit(partial(delete_unused_pictures, {old_picture_path}))
+        return sso_user
+
+    def get_microsoft_info_fields(self) -> dict[str, Any]:
+        """Get the basic fields to save in MicrosoftSSOUser."""
+        return {
+            "microsoft_id": self.user_info["id"],
+            "locale": self.user_info.get("preferredLanguage"),
+            "user_principal_name": self.user_principal_name,
+        }
+
+    def get_picture_fields(self) -> dict[str, Any]:
+        """Get the picture fields to save in MicrosoftSSOUser.
+
+        The picture is downscaled and re-encoded, following the
+        MICROSOFT_SSO_PICTURE_SIZE and MICROSOFT_SSO_PICTURE_FORMAT settings.
+        When MICROSOFT_SSO_PICTURE_STORAGE is set, the picture is saved
+        in the storage and the model keeps only its path.
+        """
+        picture_raw_data = self.user_info.get("picture_raw_data")
+        if picture_raw_data:
+            picture_raw_data = process_picture(
+                picture_raw_data,
+                size=self.auth.get_sso_value("PICTURE_SIZE"),
+                picture_format=self.auth.get_sso_value("PICTURE_FORMAT"),
+                quality=self.auth.get_sso_value("PICTURE_QUALITY"),
+            )
+        fields = {
+            "picture_raw": picture_raw_data,
+            "picture_path": None,
+            "picture_etag": self.user_info.get("picture_etag"),
+            "picture_content_type": (
+                guess_content_type(picture_raw_data) if picture_raw_data else None
+            ),
+        }
+        if picture_raw_data and get_picture_storage() is not None:
+            fields["picture_raw"] = None
+            fields["picture_path"] = save_picture(picture_raw_data)
+        return fields
+
+    def set_user_field(self, user, field_name: str, value: Any):
+        """Set the User field, tracking it only if the value changed."""
+        try:
+            user._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            # Custom user models can miss fields like first_name
+            setattr(user, field_name, value)
+            return
+        if getattr(user, field_name) != value:
+            setattr(user, field_name, value)
+            self.user_changed_fields.add(field_name)
+            self.user_changed = True
 
     def check_for_update(self, created, user):
-        auth = MicrosoftAuth(self.request)
-        if created or auth.get_sso_value("ALWAYS_UPDATE_USER_DATA"):
+        if created or self.auth.get_sso_value("ALWAYS_UPDATE_USER_DATA"):
             self.check_for_permissions(user)
-            user.first_name = self.user_info.get("givenName") or ""
-            user.last_name = self.user_info.get("surname") or ""
-            setattr(user, self.email_field_name, self.user_info_email)
-            user.set_unusable_password()
-            self.user_changed = True
+            self.set_user_field(user, "first_name", self.user_info.get("givenName") or "")
+            self.set_user_field(user, "last_name", self.user_info.get("surname") or "")
+            self.set_user_field(user, self.email_field_name, self.user_info_email)
+            if user.has_usable_password():
+                user.set_unusable_password()
+                self.user_changed_fields.add("password")
+                self.user_changed = True
 
     def check_first_super_user(self, user):
-        auth = MicrosoftAuth(self.request)
-        if auth.get_sso_value("AUTO_CREATE_FIRST_SUPERUSER"):
-            superuser_exists = self.user_model.objects.filter(is_superuser=True).exists()
+        if self.auth.get_sso_value("AUTO_CREATE_FIRST_SUPERUSER"):
+            superuser_exists = user.is_superuser or self.superuser_exists()
             if not superuser_exists:
                 message_text = _(
                     f"MICROSOFT_SSO_AUTO_CREATE_FIRST_SUPERUSER is True. "
@@ -322,47 +850,68 @@ class UserHelper:
                 )
                 messages.add_message(self.request, messages.INFO, message_text)
                 logger.warning(message_text)
-                user.is_superuser = True
-                user.is_staff = True
-                self.user_changed = True
+                self.set_user_field(user, "is_superuser", True)
+                self.set_user_field(user, "is_staff", True)
+
+    def superuser_exists(self) -> bool:
+        """Check if there is a superuser in the database.
+
+        Only the positive result is cached, because it rarely goes back.
+        The cache is cleared by the User post_save/post_delete signals.
+        """
+        if cache.get(SUPERUSER_EXISTS_CACHE_KEY):
+            return True
+        exists = self.user_model.objects.filter(is_superuser=True).exists()
+        if exists:
+            cache.set(SUPERUSER_EXISTS_CACHE_KEY, True, None)
+        return exists
+
+    def get_permission_index(self, key: str) -> PermissionIndex:
+        return get_permission_index(
+            key, self.auth.get_sso_value(key), conf.MICROSOFT_SSO_PERMISSION_LOADER
+        )
 
     def check_for_permissions(self, user):
         user_email = getattr(user, self.email_field_name)
-        auth = MicrosoftAuth(self.request)
         username = getattr(user, self.username_field.name, None)
-        staff_list = auth.get_sso_value("STAFF_LIST")
-        if user_email in staff_list or username in staff_list or "*" in staff_list:
+        if self.get_permission_index("STAFF_LIST").match(user_email, username):
             message_text = _(
                 f"User: {self.user_principal_name} in MICROSOFT_SSO_STAFF_LIST. "
                 f"Added Staff Permission."
             )
             messages.add_message(self.request, messages.INFO, message_text)
             logger.debug(message_text)
-            user.is_staff = True
+            self.set_user_field(user, "is_staff", True)
 
-        superuser_list = auth.get_sso_value("SUPERUSER_LIST")
-        if user_email in superuser_list or username in superuser_list:
+        if self.get_permission_index("SUPERUSER_LIST").match(user_email, username):
             message_text = _(
                 f"User: {self.user_principal_name} in MICROSOFT_SSO_SUPERUSER_LIST. "
                 f"Added SuperUser Permission."
             )
             messages.add_message(self.request, messages.INFO, message_text)
             logger.debug(message_text)
-            user.is_superuser = True
-            user.is_staff = True
+            self.set_user_field(user, "is_superuser", True)
+            self.set_user_field(user, "is_staff", True)
+
+    def get_find_user_lookups(self) -> list[dict[str, Any]]:
+        """Get the lookups used to find the user, in order.
+
+        Each lookup is a single filter, so the database can seek the indexed
+        ones instead of scanning an OR across a join. The case-insensitive
+        username match runs last, only when the indexed lookups miss, to
+        find usernames created with another case (ex. by an admin).
+        """
+        if self.auth.get_sso_value("UNIQUE_EMAIL"):
+            return [{f"{self.email_field_name}__iexact": self.user_info_email}]
+        return [
+            {"microsoftssouser__user_principal_name": self.user_principal_name},
+            {self.username_field.attname: self.user_principal_name},
+            {f"{self.username_field.attname}__iexact": self.user_principal_name},
+        ]
 
     def find_user(self):
-        auth = MicrosoftAuth(self.request)
-        if auth.get_sso_value("UNIQUE_EMAIL"):
-            query = self.user_model.objects.filter(
-                **{f"{self.email_field_name}__iexact": self.user_info_email}
-            )
-        else:
-            username_query = {
-                f"{self.username_field.attname}__iexact": self.user_principal_name
-            }
-            query = self.user_model.objects.filter(
-                Q(microsoftssouser__user_principal_name__iexact=self.user_principal_name)
-                | Q(**username_query)
-            )
-        return query.get() if query.exists() else None
+        for lookup in self.get_find_user_lookups():
+            user = self.user_model.objects.filter(**lookup).first()
+            if user:
+                return user
+        return None
@@ -0,0 +1,128 @@
+import hashlib
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from django_microsoft_sso.main import MicrosoftAuth
+from django_microsoft_sso.models import MicrosoftSSOUser
+from django_microsoft_sso.pictures import (
+    PICTURE_FORMATS,
+    delete_unused_pictures,
+    get_picture_storage,
+    guess_content_type,
+    process_picture,
+    save_picture,
+)
+from django_microsoft_sso.provisioning import get_command_request
+
+
+class Command(BaseCommand):
+    help = (
+        "Downscale and re-encode the saved user pictures, " "and save their content type."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            choices=list(PICTURE_FORMATS),
+            help="Picture format. Default: MICROSOFT_SSO_PICTURE_FORMAT",
+        )
+        parser.add_argument(
+            "--quality",
+            type=int,
+            help="Encoder quality, from 1 to 100. Default: MICROSOFT_SSO_PICTURE_QUALITY",
+        )
+        parser.add_argument(
+            "--size",
+            help="Maximum picture size, like 96x96. Default: MICROSOFT_SSO_PICTURE_SIZE",
+        )
+        parser.add_argument(
+            "--domain",
+            help="Site domain used to resolve the callable settings.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Pictures per database write. Default: 100",
+        )
+
+    def handle(self, *args, **options):
+        auth = MicrosoftAuth(get_command_request(options["domain"]))
+        picture_format = options["format"] or auth.get_sso_value("PICTURE_FORMAT")
+        quality = options["quality"] or auth.get_sso_value("PICTURE_QUALITY")
+        size = options["size"] or auth.get_sso_value("PICTURE_SIZE")
+
+        queryset = (
+            MicrosoftSSOUser.objects.filter(
+                Q(picture_raw__isnull=False) | Q(picture_path__isnull=False)
+            )
+            .only(
+                "pk",
+                "picture_raw",
+                "picture_path",
+                "picture_etag",
+                "picture_content_type",
+            )
+            .order_by("pk")
+        )
+        converted = 0
+        size_before = 0
+        size_after = 0
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[: options["batch_size"]])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            changed_sso_users = []
+            old_paths = set()
+            for sso_user in batch:
+                content = self.get_content(sso_user)
+                if not content:
+                    continue
+                new_content = process_picture(content, size, picture_format, quality)
+                content_type = guess_content_type(new_content)
+                if new_content == content and content_type == sso_user.picture_content_type:
+                    continue
+                old_path = sso_user.picture_path
+                self.set_content(sso_user, new_content)
+                if old_path and old_path != sso_user.picture_path:
+                    old_paths.add(old_path)
+                # New bytes need a new version, for the avatar ETag and URL.
+                # Graph doesn't match it, so the next login downloads
+                # the picture again, with the current settings.
+                sso_user.picture_etag = f'"{hashlib.sha256(new_content).hexdigest()[:32]}"'
+                sso_user.picture_content_type = content_type
+                changed_sso_users.append(sso_user)
+                converted += 1
+                size_before += len(content)
+                size_after += len(new_content)
+            MicrosoftSSOUser.objects.bulk_update(
+                changed_sso_users,
+                ["picture_raw", "picture_path", "picture_etag", "picture_content_type"],
+            )
+            delete_unused_pictures(old_paths)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Pictures converted: {converted} "
+                f"({size_before} bytes before, {size_after} bytes after)"
+            )
+        )
+
+    @staticmethod
+    def get_content(sso_user: MicrosoftSSOUser) -> bytes | None:
+        storage = get_picture_storage()
+        if sso_user.picture_path and storage is not None:
+            with storage.open(sso_user.picture_path) as picture_file:
+                return picture_file.read()
+        return bytes(sso_user.picture_raw) if sso_user.picture_raw else None
+
+    @staticmethod
+    def set_content(sso_user: MicrosoftSSOUser, content: bytes):
+        storage = get_picture_storage()
+        if sso_user.picture_path and storage is not None:
+            sso_user.picture_path = save_picture(content)
+        else:
+            sso_user.picture_raw = content
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from django_microsoft_sso.main import GRAPH_API_URL
+from django_microsoft_sso.provisioning import UserProvisioner, get_command_request
+
+
+class Command(BaseCommand):
+    help = "Create and update Django users from the Microsoft Graph /users endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--domain",
+            help="Site domain used to resolve the callable settings.",
+        )
+        parser.add_argument(
+            "--delta",
+            action="store_true",
+            help="Sync only the users changed since the last delta sync.",
+        )
+        parser.add_argument(
+            "--graph-api-url",
+            default=GRAPH_API_URL,
+            help=f"Microsoft Graph base URL. Default: {GRAPH_API_URL}",
+        )
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            default=999,
+            help="Users per Graph page (max. 999). Default: 999",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Users per database write. Default: 500",
+        )
+
+    def handle(self, *args, **options):
+        provisioner = UserProvisioner(
+            request=get_command_request(options["domain"]),
+            graph_api_url=options["graph_api_url"].rstrip("/"),
+            page_size=options["page_size"],
+            batch_size=options["batch_size"],
+            delta=options["delta"],
+            sync_name=options["domain"] or "default",
+        )
+        result = provisioner.run()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Users created: {result.created}, updated: {result.updated}, "
+                f"deactivated: {result.deactivated}, skipped: {result.skipped}"
+            )
+        )
@@ -0,0 +1,212 @@
+import importlib
+import re
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from fnmatch import translate
+from functools import lru_cache
+from typing import Any, Callable, Hashable, Iterable
+
+from loguru import logger
+
+MATCHERS_CACHE_SIZE = 32
+
+_matchers: dict[tuple[str, tuple[str, ...]], Any] = {}
+_lock = threading.Lock()
+
+
+def _get_cached_matcher(
+    kind: str, source: Iterable[str], build: Callable[[tuple[str, ...]], Any]
+) -> Any:
+    """Get the matcher built for the source entries, building it on first use.
+
+    Matchers are kept by a snapshot of the entries, so a list changed
+    in place gets a new matcher, and callables which return a new list
+    on each call reuse the matcher built for the same entries.
+    """
+    entries = tuple(source or ())
+    key = (kind, entries)
+    matcher = _matchers.get(key)
+    if matcher is not None:
+        return matcher
+    matcher = build(entries)
+    with _lock:
+        if len(_matchers) >= MATCHERS_CACHE_SIZE:
+            _matchers.clear()
+        _matchers[key] = matcher
+    return matcher
+
+
+@dataclass(frozen=True)
+class DomainMatcher:
+    """Match email domains against a list of allowed domains.
+
+    The list accepts:
+        * "*": any domain;
+        * "example.com": this domain only;
+        * "*.example.com": any subdomain of example.com.
+
+    Domains are kept in sets, so each match costs one lookup per
+    domain label, no matter how many domains the list has.
+    """
+
+    exact: frozenset[str]
+    suffixes: frozenset[str]
+    match_all: bool = False
+
+    @classmethod
+    def from_domains(cls, domains: Iterable[str]) -> "DomainMatcher":
+        exact = set()
+        suffixes = set()
+        match_all = False
+        for domain in domains:
+            domain = domain.strip().lower().lstrip("@").rstrip(".")
+            if domain == "*":
+                match_all = True
+            elif domain.startswith("*."):
+                suffixes.add(domain[2:])
+            elif domain:
+                exact.add(domain)
+        return cls(frozenset(exact), frozenset(suffixes), match_all)
+
+    def match(self, domain: str) -> bool:
+        domain = domain.lower().rstrip(".")
+        if self.match_all or domain in self.exact:
+            return True
+        if not self.suffixes:
+            return False
+        labels = domain.split(".")
+        return any(
+            ".".join(labels[index:]) in self.suffixes for index in range(1, len(labels))
+        )
+
+
+def get_domain_matcher(domains: Iterable[str]) -> DomainMatcher:
+    """Get the DomainMatcher for the domains list, built once per entries."""
+    return _get_cached_matcher("domains", domains, DomainMatcher.from_domains)
+
+
+@dataclass(frozen=True)
+class PermissionIndex:
+    """Match users against a permission list, like MICROSOFT_SSO_STAFF_LIST.
+
+    The list accepts:
+        * "*": any user (ignored when allow_all is False, like on SUPERUSER_LIST);
+        * "user@example.com" or "username": this user only;
+        * "@example.com", "*@example.com" or "*@*.example.com": any user
+          from this domain (or its subdomains);
+        * glob patterns, like "admin-*@example.com".
+
+    Names and domains are kept in sets, and all patterns are compiled
+    in a single regular expression.
+    """
+
+    names: frozenset[str]
+    domains: DomainMatcher
+    pattern: re.Pattern | None = None
+    match_all: bool = False
+
+    @classmethod
+    def from_entries(
+        cls, entries: Iterable[str], allow_all: bool = True
+    ) -> "PermissionIndex":
+        names = set()
+        domains = []
+        patterns = []
+        match_all = False
+        for entry in entries:
+            entry = entry.strip().lower()
+            if entry == "*":
+                if allow_all:
+                    match_all = True
+                else:
+                    logger.warning(
+                        "Ignoring '*': it is allowed only in MICROSOFT_SSO_STAFF_LIST."
+                    )
+            elif entry.startswith("@"):
+                domains.append(entry[1:])
+            elif entry.startswith("*@") and not any(char in entry[2:] for char in "?["):
+                domains.append(entry[2:])
+            elif any(char in entry for char in "*?["):
+                patterns.append(translate(entry))
+            elif entry:
+                names.add(entry)
+        pattern = re.compile("|".join(patterns)) if patterns else None
+        return cls(
+            frozenset(names), DomainMatcher.from_domains(domains), pattern, match_all
+        )
+
+    def match(self, *values: str | None) -> bool:
+        """Check if any of the values (ex. email and username) is in the list."""
+        if self.match_all:
+            return True
+        for value in values:
+            if not value:
+                continue
+            value = value.lower()
+            if value in self.names:
+                return True
+            if "@" in value and self.domains.match(value.rsplit("@", 1)[-1]):
+                return True
+            if self.pattern is not None and self.pattern.match(value):
+                return True
+        return False
+
+
+class PermissionLoader(ABC):
+    """Base class for MICROSOFT_SSO_PERMISSION_LOADER.
+
+    Use it to load permission entries from another source, like
+    a database table or a file. The entries are added to the ones
+    in the settings. The index is rebuilt only when the version changes.
+    """
+
+    @abstractmethod
+    def get_version(self) -> Hashable:
+        """Get the current version of the entries, like a file mtime.
+
+        This method runs on every login, so it must be cheap.
+        """
+
+    @abstractmethod
+    def load(self, name: str) -> Iterable[str]:
+        """Load the entries for the list name ("STAFF_LIST" or "SUPERUSER_LIST")."""
+
+
+@lru_cache(maxsize=None)
+def get_permission_loader(loader_path: str) -> PermissionLoader:
+    module_path, class_name = loader_path.rsplit(".", 1)
+    return getattr(importlib.import_module(module_path), class_name)()
+
+
+def get_permission_index(
+    name: str, entries: Iterable[str], loader_path: str | None = None
+) -> PermissionIndex:
+    """Get the PermissionIndex for the setting entries.
+
+    The index is built once per entries and, when using a
+    MICROSOFT_SSO_PERMISSION_LOADER, once per loader version.
+
+    "*" is accepted only on STAFF_LIST: it never makes all users superusers.
+    """
+    allow_all = name != "SUPERUSER_LIST"
+    if not loader_path:
+        return _get_cached_matcher(
+            name,
+            entries,
+            lambda snapshot: PermissionIndex.from_entries(snapshot, allow_all),
+        )
+
+    loader = get_permission_loader(loader_path)
+    version = loader.get_version()
+    state = _get_cached_matcher(
+        f"{name}:{loader_path}",
+        entries,
+        lambda snapshot: {"entries": snapshot, "version": None, "index": None},
+    )
+    if state["index"] is None or state["version"] != version:
+        state["index"] = PermissionIndex.from_entries(
+            [*state["entries"], *loader.load(name)], allow_all
+        )
+        state["version"] = version
+    return state["index"]
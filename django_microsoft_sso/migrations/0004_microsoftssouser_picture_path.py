@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_microsoft_sso', '0003_microsoftssouser_picture_etag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='microsoftssouser',
+            name='picture_path',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
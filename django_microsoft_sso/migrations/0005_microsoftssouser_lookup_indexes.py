@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:11
+
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def lowercase_user_principal_names(apps, schema_editor):
+    MicrosoftSSOUser = apps.get_model("django_microsoft_sso", "MicrosoftSSOUser")
+    MicrosoftSSOUser.objects.exclude(user_principal_name=None).update(
+        user_principal_name=Lower("user_principal_name")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_microsoft_sso', '0004_microsoftssouser_picture_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            lowercase_user_principal_names, migrations.RunPython.noop
+        ),
+        migrations.AlterField(
+            model_name='microsoftssouser',
+            name='microsoft_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='microsoftssouser',
+            name='user_principal_name',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_microsoft_sso", "0005_microsoftssouser_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MicrosoftSSOSyncState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("delta_link", models.TextField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Microsoft SSO Sync State",
+                "db_table": "microsoft_sso_sync_state",
+            },
+        ),
+    ]
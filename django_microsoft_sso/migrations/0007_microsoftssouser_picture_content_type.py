@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_microsoft_sso", "0006_microsoftssosyncstate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="microsoftssouser",
+            name="picture_content_type",
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+    ]
@@ -2,30 +2,80 @@ from base64 import b64encode
 
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.urls import NoReverseMatch, reverse
+from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 
+from django_microsoft_sso.pictures import (
+    get_picture_storage,
+    get_picture_version,
+    guess_content_type,
+)
+
 User = get_user_model()
 
 
 class MicrosoftSSOUser(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    user_principal_name = models.CharField(max_length=255, null=True, blank=True)
-    microsoft_id = models.CharField(max_length=255, blank=True, null=True)
+    user_principal_name = models.CharField(
+        max_length=255, null=True, blank=True, db_index=True
+    )
+    microsoft_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
     picture_raw = models.BinaryField(blank=True, null=True)
+    picture_etag = models.CharField(max_length=255, blank=True, null=True)
+    picture_path = models.CharField(max_length=255, blank=True, null=True)
+    picture_content_type = models.CharField(max_length=50, blank=True, null=True)
     locale = models.CharField(max_length=5, blank=True, null=True)
 
+    @property
+    def picture_url(self) -> str | None:
+        """Get the picture URL.
+
+        Pictures saved in a storage use the storage URL. Pictures saved in the
+        database use the avatar view, versioned by the picture ETag, so browsers
+        can cache them.
+        """
+        storage = get_picture_storage()
+        if self.picture_path and storage is not None:
+            return storage.url(self.picture_path)
+        # Check the ETag first, so the picture blob isn't loaded
+        if not self.picture_etag and not self.picture_raw:
+            return None
+        try:
+            url = reverse("django_microsoft_sso:avatar", args=[self.user_id])
+        except NoReverseMatch:
+            return None
+        if self.picture_etag:
+            url += f"?v={get_picture_version(self.picture_etag)}"
+        return url
+
     @property
     def picture(self):
+        picture_url = self.picture_url
+        if picture_url:
+            return format_html(
+                '<img src="{}" width="75" height="75" loading="lazy">', picture_url
+            )
         if self.picture_raw:
+            content_type = self.picture_content_type or guess_content_type(
+                bytes(self.picture_raw)
+            )
             return mark_safe(
-                '<img src = "data: image/png; base64, {}"'
+                '<img src = "data: {}; base64, {}"'
                 ' width="75" height="75">'.format(
-                    b64encode(self.picture_raw).decode("utf8")
+                    content_type, b64encode(self.picture_raw).decode("utf8")
                 )
             )
         return None
 
+    def save(self, *args, **kwargs):
+        # UPNs are case-insensitive: keep them lowercase, so
+        # lookups can use the index with an exact match
+        if self.user_principal_name:
+            self.user_principal_name = self.user_principal_name.lower()
+        super().save(*args, **kwargs)
+
     def __str__(self):
         user_email = getattr(self.user, User.get_email_field_name())
         return f"{user_email} ({self.microsoft_id})"
@@ -33,3 +83,18 @@ class MicrosoftSSOUser(models.Model):
     class Meta:
         db_table = "microsoft_sso_user"
         verbose_name = _("Microsoft SSO User")
+
+
+class MicrosoftSSOSyncState(models.Model):
+    """Last Graph delta link saved by the users sync, per site."""
+
+    name = models.CharField(max_length=255, unique=True)
+    delta_link = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        db_table = "microsoft_sso_sync_state"
+        verbose_name = _("Microsoft SSO Sync State")
@@ -0,0 +1,140 @@
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage, storages
+from loguru import logger
+
+from django_microsoft_sso import conf
+
+PICTURES_PATH = "django_microsoft_sso/pictures"
+
+PICTURE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+PICTURE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/bmp": ".bmp",
+    "image/webp": ".webp",
+    "image/avif": ".avif",
+}
+
+
+def guess_content_type(content: bytes) -> str:
+    """Guess the picture content type from its first bytes."""
+    for signature, content_type in PICTURE_SIGNATURES:
+        if content.startswith(signature):
+            return content_type
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    if content[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif"
+    return "application/octet-stream"
+
+
+PICTURE_FORMATS = {"webp": "WEBP", "avif": "AVIF"}
+
+
+def process_picture(
+    content: bytes,
+    size: str | None = None,
+    picture_format: str | None = None,
+    quality: int = 80,
+) -> bytes:
+    """Downscale and re-encode the picture, before saving it.
+
+    :param size: Downscale the picture to fit in this size (ex. "96x96").
+    :param picture_format: Re-encode the picture in this format ("webp" or "avif").
+    :param quality: The encoder quality, from 1 to 100.
+    :return: The new picture. Without Pillow (install django-microsoft-sso[pictures]),
+        or if nothing needs to change, the picture is returned unchanged.
+    """
+    if not size and not picture_format:
+        return content
+    try:
+        from PIL import Image
+    except ImportError:
+        return content
+
+    try:
+        image = Image.open(BytesIO(content))
+        source_format = image.format
+        target_format = PICTURE_FORMATS.get((picture_format or "").lower(), source_format)
+        resize = False
+        if size:
+            width, height = (int(value) for value in size.lower().split("x"))
+            resize = image.width > width or image.height > height
+        if not resize and target_format == source_format:
+            return content
+        if resize:
+            image.thumbnail((width, height))
+        if target_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = BytesIO()
+        save_options = {"quality": quality} if target_format != source_format else {}
+        image.save(output, format=target_format, **save_options)
+    except (KeyError, OSError, ValueError, Image.DecompressionBombError) as error:
+        logger.debug(f"Cannot process the user picture: {error}")
+        return content
+    return output.getvalue()
+
+
+def get_picture_version(picture_etag: str) -> str:
+    """Get an opaque version for the picture, safe to use in URLs and ETags."""
+    return hashlib.sha256(picture_etag.encode()).hexdigest()[:32]
+
+
+def get_picture_storage() -> Storage | None:
+    """Get the storage for user pictures.
+
+    :return: The storage from MICROSOFT_SSO_PICTURE_STORAGE alias,
+        or None to keep pictures in the database.
+    """
+    alias = conf.MICROSOFT_SSO_PICTURE_STORAGE
+    if not alias:
+        return None
+    return storages[alias]
+
+
+def save_picture(content: bytes) -> str:
+    """Save the picture in the picture storage.
+
+    File names are the picture hash, so the same picture is saved only
+    once and the file can be cached forever by browsers and CDNs.
+
+    :return: The picture path, inside the storage.
+    """
+    storage = get_picture_storage()
+    digest = hashlib.sha256(content).hexdigest()
+    extension = PICTURE_EXTENSIONS.get(guess_content_type(content), "")
+    name = f"{PICTURES_PATH}/{digest}{extension}"
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(content))
+    return name
+
+
+def delete_unused_pictures(paths: set[str]):
+    """Delete the old picture files, when no user uses them anymore.
+
+    Files are named by their content, so users with the
+    same picture share the same file.
+    """
+    from django_microsoft_sso.models import MicrosoftSSOUser
+
+    storage = get_picture_storage()
+    if storage is None or not paths:
+        return
+    used_paths = set(
+        MicrosoftSSOUser.objects.filter(picture_path__in=paths).values_list(
+            "picture_path", flat=True
+        )
+    )
+    for path in paths - used_paths:
+        storage.delete(path)
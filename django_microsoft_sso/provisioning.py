@@ -0,0 +1,341 @@
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Any, Callable, Iterator
+
+from django.contrib.auth import get_user_model
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpRequest
+from httpx import HTTPStatusError
+from loguru import logger
+
+from django_microsoft_sso.clients import get_http_client
+from django_microsoft_sso.main import GRAPH_API_URL, MicrosoftAuth, UserHelper
+from django_microsoft_sso.models import MicrosoftSSOSyncState, MicrosoftSSOUser
+from django_microsoft_sso.registry import hook_registry
+
+
+def get_command_request(domain: str | None = None) -> HttpRequest:
+    """Build a request for code running outside a view.
+
+    Callable settings and hooks receive this request, so it has
+    a session and message storage, like the callback request.
+
+    :param domain: The site domain, used to resolve callable settings.
+    """
+    request = HttpRequest()
+    request.method = "GET"
+    request.path = request.path_info = "/"
+    request.META = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": "/",
+        "SERVER_NAME": domain or "localhost",
+        "SERVER_PORT": "80",
+    }
+    if domain:
+        request.META["HTTP_HOST"] = domain
+    SessionMiddleware(get_response=lambda req: None).process_request(request)
+    setattr(request, "_messages", FallbackStorage(request))
+    return request
+
+
+@dataclass
+class ProvisionResult:
+    created: int = 0
+    updated: int = 0
+    deactivated: int = 0
+    skipped: int = 0
+
+
+@dataclass
+class UserProvisioner:
+    """Create and update Django users from the Microsoft Graph /users endpoint.
+
+    Records are mapped with UserHelper, like on login, and saved in
+    chunks with bulk_create/bulk_update.
+
+    On delta mode, it reads the /users/delta endpoint from the last saved
+    delta link, so only the users changed since the last sync are applied.
+    """
+
+    request: HttpRequest
+    graph_api_url: str = GRAPH_API_URL
+    page_size: int = 999
+    batch_size: int = 500
+    delta: bool = False
+    sync_name: str = "default"
+    result: ProvisionResult = field(default_factory=ProvisionResult)
+    delta_link: str | None = None
+
+    @cached_property
+    def auth(self) -> MicrosoftAuth:
+        return MicrosoftAuth(self.request)
+
+    @cached_property
+    def user_model(self):
+        return get_user_model()
+
+    def get_callback(self, key: str) -> Callable:
+        return hook_registry.get_hook(key, self.auth)
+
+    def get_users_url(self) -> str:
+        if self.delta:
+            url = f"{self.graph_api_url}/users/delta?"
+        else:
+            url = f"{self.graph_api_url}/users?$top={self.page_size}&"
+        user_fields = self.auth.get_graph_user_fields()
+        if user_fields:
+            if "accountEnabled" not in user_fields:
+                user_fields = [*user_fields, "accountEnabled"]
+            url += f"$select={','.join(user_fields)}"
+        return url.rstrip("?&")
+
+    def iter_pages(self, url: str, token: str) -> Iterator[list[dict[str, Any]]]:
+        """Yield each page of users, following the @odata.nextLink."""
+        headers = {
+            "Authorization": f"Bearer {token}",
+            # Delta queries don't support $top
+            "Prefer": f"odata.maxpagesize={self.page_size}",
+        }
+        timeout = self.auth.get_sso_value("GRAPH_TIMEOUT")
+        while url:
+            response = get_http_client().get(url, headers=headers, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
+            yield data.get("value", [])
+            url = data.get("@odata.nextLink")
+            self.delta_link = data.get("@odata.deltaLink")
+
+    def run(self) -> ProvisionResult:
+        token = self.auth.get_app_token()
+        url = self.get_users_url()
+        if self.delta:
+            sync_state = MicrosoftSSOSyncState.objects.filter(name=self.sync_name).first()
+            if sync_state:
+                url = sync_state.delta_link
+        try:
+            self.sync_pages(url, token)
+        except HTTPStatusError as error:
+            if not self.delta or error.response.status_code != 410:
+                raise
+            # Delta link expired: Graph asks for a full sync
+            logger.warning("Microsoft Graph delta link expired. Starting a new sync.")
+            self.sync_pages(self.get_users_url(), token)
+
+        if self.delta and self.delta_link:
+            MicrosoftSSOSyncState.objects.update_or_create(
+                name=self.sync_name, defaults={"delta_link": self.delta_link}
+            )
+        return self.result
+
+    def sync_pages(self, url: str, token: str):
+        for page in self.iter_pages(url, token):
+            for start in range(0, len(page), self.batch_size):
+                self.provision(page[start : start + self.batch_size])
+
+    def get_user_key(self, helper: UserHelper) -> str:
+        if self.auth.get_sso_value("UNIQUE_EMAIL"):
+            return helper.user_info_email
+        return helper.user_principal_name
+
+    def get_valid_helpers(self, users_info: list[dict[str, Any]]) -> list[UserHelper]:
+        pre_validate_callback = self.get_callback("PRE_VALIDATE_CALLBACK")
+        unique_email = self.auth.get_sso_value("UNIQUE_EMAIL")
+        helpers = {}
+        for user_info in users_info:
+            if not user_info.get("userPrincipalName"):
+                self.result.skipped += 1
+                continue
+            helper = UserHelper(user_info, self.request)
+            if (
+                (unique_email and not helper.user_info_email)
+                or not helper.email_is_valid
+                or not pre_validate_callback(user_info, self.request)
+            ):
+                logger.debug(f"Skipping user: {helper.user_principal_name}")
+                self.result.skipped += 1
+                continue
+            helpers[self.get_user_key(helper)] = helper
+        return list(helpers.values())
+
+    def get_existing_users(self, keys: list[str]) -> dict[str, Any]:
+        """Find the existing users, with the same lookups used on login.
+
+        Keys are lowercase, as saved by this library, so exact lookups
+        are used and the database can use the field indexes.
+        """
+        if self.auth.get_sso_value("UNIQUE_EMAIL"):
+            email_field_name = self.user_model.get_email_field_name()
+            queryset = self.user_model.objects.annotate(sso_key=F(email_field_name)).filter(
+                **{f"{email_field_name}__in": keys}
+            )
+            return {user.sso_key: user for user in queryset}
+
+        username_field_name = self.user_model._meta.get_field(
+            self.user_model.USERNAME_FIELD
+        ).attname
+        queryset = self.user_model.objects.annotate(sso_key=F(username_field_name)).filter(
+            **{f"{username_field_name}__in": keys}
+        )
+        users = {user.sso_key: user for user in queryset}
+        # Users found by the MicrosoftSSOUser UPN take precedence, like on login
+        queryset = self.user_model.objects.annotate(
+            sso_key=F("microsoftssouser__user_principal_name")
+        ).filter(microsoftssouser__user_principal_name__in=keys)
+        users.update({user.sso_key: user for user in queryset})
+        return users
+
+    def provision(self, users_info: list[dict[str, Any]]):
+        """Create or update one chunk of Graph users."""
+        if self.delta:
+            users_info = self.apply_changes(users_info)
+        helpers = self.get_valid_helpers(users_info)
+        keys = [self.get_user_key(helper) for helper in helpers]
+        existing_users = self.get_existing_users(keys)
+        pre_create_callback = self.get_callback("PRE_CREATE_CALLBACK")
+        username_field_name = self.user_model._meta.get_field(
+            self.user_model.USERNAME_FIELD
+        ).attname
+
+        new_users = []
+        changed_users = []
+        changed_fields = set()
+        for helper in helpers:
+            user = existing_users.get(self.get_user_key(helper))
+            created = user is None
+            if created:
+                extra_users_args = pre_create_callback(helper.user_info, self.request)
+                user = self.user_model(
+                    **{
+                        username_field_name: helper.user_principal_name,
+                        **(extra_users_args or {}),
+                    }
+                )
+            helper.check_for_update(created, user)
+            if "accountEnabled" in helper.user_info:
+                helper.set_user_field(user, "is_active", helper.user_info["accountEnabled"])
+            if created:
+                new_users.append(user)
+            elif helper.user_changed:
+                changed_users.append(user)
+                changed_fields.update(helper.user_changed_fields)
+
+        with transaction.atomic():
+            self.user_model.objects.bulk_create(new_users, batch_size=self.batch_size)
+            if changed_users and changed_fields:
+                self.user_model.objects.bulk_update(
+                    changed_users, list(changed_fields), batch_size=self.batch_size
+                )
+            if self.auth.get_sso_value("SAVE_BASIC_MICROSOFT_INFO"):
+                # Some databases don't return the primary keys on bulk_create
+                users = self.get_existing_users(keys)
+                self.save_microsoft_info(helpers, users)
+
+        self.result.created += len(new_users)
+        self.result.updated += len(changed_users)
+
+    def apply_changes(self, users_info: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Apply the delta records of users already synced.
+
+        Delta records have only the changed properties. Users removed
+        from the directory are deactivated.
+
+        :return: The records of users not found, to be created.
+        """
+        sso_users = {
+            sso_user.microsoft_id: sso_user
+            for sso_user in MicrosoftSSOUser.objects.select_related("user").filter(
+                microsoft_id__in=[user_info["id"] for user_info in users_info]
+            )
+        }
+        email_field_name = self.user_model.get_email_field_name()
+        new_users_info = []
+        changed_users = []
+        changed_fields = set()
+        changed_sso_users = []
+        changed_sso_fields = set()
+        for user_info in users_info:
+            sso_user = sso_users.get(user_info["id"])
+            if sso_user is None:
+                if "@removed" not in user_info:
+                    new_users_info.append(user_info)
+                continue
+
+            user = sso_user.user
+            helper = UserHelper(user_info, self.request)
+            if "@removed" in user_info:
+                helper.set_user_field(user, "is_active", False)
+                self.result.deactivated += int(helper.user_changed)
+            else:
+                if "givenName" in user_info:
+                    helper.set_user_field(user, "first_name", user_info["givenName"] or "")
+                if "surname" in user_info:
+                    helper.set_user_field(user, "last_name", user_info["surname"] or "")
+                if "mail" in user_info:
+                    helper.set_user_field(user, email_field_name, helper.user_info_email)
+                if "accountEnabled" in user_info:
+                    helper.set_user_field(user, "is_active", user_info["accountEnabled"])
+                if helper.user_changed:
+                    self.result.updated += 1
+
+                sso_fields = {}
+                if user_info.get("userPrincipalName"):
+                    sso_fields["user_principal_name"] = helper.user_principal_name
+                if "preferredLanguage" in user_info:
+                    sso_fields["locale"] = user_info["preferredLanguage"]
+                sso_changed = False
+                for field_name, value in sso_fields.items():
+                    if getattr(sso_user, field_name) != value:
+                        setattr(sso_user, field_name, value)
+                        changed_sso_fields.add(field_name)
+                        sso_changed = True
+                if sso_changed:
+                    changed_sso_users.append(sso_user)
+
+            if helper.user_changed:
+                changed_users.append(user)
+                changed_fields.update(helper.user_changed_fields)
+
+        with transaction.atomic():
+            if changed_users:
+                self.user_model.objects.bulk_update(
+                    changed_users, list(changed_fields), batch_size=self.batch_size
+                )
+            if changed_sso_users:
+                MicrosoftSSOUser.objects.bulk_update(
+                    changed_sso_users, list(changed_sso_fields), batch_size=self.batch_size
+                )
+        return new_users_info
+
+    def save_microsoft_info(self, helpers: list[UserHelper], users: dict[str, Any]):
+        sso_users = MicrosoftSSOUser.objects.in_bulk(
+            [user.pk for user in users.values()], field_name="user_id"
+        )
+        new_sso_users = []
+        changed_sso_users = []
+        changed_fields = set()
+        for helper in helpers:
+            user = users.get(self.get_user_key(helper))
+            if user is None:
+                continue
+            fields = helper.get_microsoft_info_fields()
+            sso_user = sso_users.get(user.pk)
+            if sso_user is None:
+                new_sso_users.append(MicrosoftSSOUser(user=user, **fields))
+                continue
+            sso_user_changed = False
+            for field_name, value in fields.items():
+                if getattr(sso_user, field_name) != value:
+                    setattr(sso_user, field_name, value)
+                    changed_fields.add(field_name)
+                    sso_user_changed = True
+            if sso_user_changed:
+                changed_sso_users.append(sso_user)
+
+        MicrosoftSSOUser.objects.bulk_create(new_sso_users, batch_size=self.batch_size)
+        if changed_sso_users:
+            MicrosoftSSOUser.objects.bulk_update(
+                changed_sso_users, list(changed_fields), batch_size=self.batch_size
+            )
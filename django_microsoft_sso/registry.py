@@ -0,0 +1,224 @@
+import importlib
+import inspect
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from django.conf import settings
+from django.templatetags.static import static
+from django.urls import get_script_prefix, get_urlconf, reverse
+from django.utils.translation import get_language
+from loguru import logger
+
+from django_microsoft_sso import conf
+
+PROVIDER_APP_PATTERN = re.compile(r"^django_(.+)_sso$")
+PROVIDER_SETTINGS = [
+    "INSTALLED_APPS",
+    "ROOT_URLCONF",
+    "STATIC_URL",
+    "STORAGES",
+    "STATICFILES_STORAGE",
+]
+HOOK_SETTINGS = ["PRE_VALIDATE_CALLBACK", "PRE_CREATE_CALLBACK", "PRE_LOGIN_CALLBACK"]
+BACKEND_SETTINGS = ["AUTHENTICATION_BACKEND"]
+
+
+def is_hook_callable(value: Any) -> bool:
+    """Check if a callable setting is the hook itself.
+
+    Hooks receive two arguments (ex. the user info and the request), while
+    callable settings receive only the request and return the hook path.
+    """
+    try:
+        inspect.signature(value).bind(None, None)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def get_backend_path(value: Any) -> str:
+    if isinstance(value, type):
+        return f"{value.__module__}.{value.__qualname__}"
+    return value
+
+
+class HookRegistry:
+    """Resolve the hook and backend paths from settings, once per path.
+
+    The settings accept dotted paths or the objects themselves. A setting
+    can also be a callable which receives the request and returns the path.
+
+    Paths are imported on app ready, and again when the settings change.
+    """
+
+    def __init__(self):
+        self._resolved: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, path: str) -> Any:
+        """Import the object from the dotted path.
+
+        :raises ImportError: If the module or the attribute doesn't exist.
+        """
+        resolved = self._resolved.get(path)
+        if resolved is not None:
+            return resolved
+        try:
+            module_path, name = path.rsplit(".", 1)
+            resolved = getattr(importlib.import_module(module_path), name)
+        except (ValueError, AttributeError) as error:
+            raise ImportError(f"Cannot import '{path}'.") from error
+        with self._lock:
+            self._resolved[path] = resolved
+        return resolved
+
+    def get_hook(self, key: str, auth) -> Callable:
+        """Get the hook callable for the setting key, like PRE_LOGIN_CALLBACK.
+
+        :param auth: The MicrosoftAuth instance, used on callable settings.
+        """
+        value = getattr(conf, f"MICROSOFT_SSO_{key}")
+        if callable(value) and is_hook_callable(value):
+            return value
+        value = auth.get_sso_value(key)
+        if callable(value):
+            return value
+        return self.resolve(value)
+
+    def get_backend(self, auth) -> str | None:
+        """Get the checked authentication backend path.
+
+        Django does not raise errors if the backend is wrong, so
+        the path is imported before its use.
+
+        :param auth: The MicrosoftAuth instance, used on callable settings.
+        :raises ImportError: If the backend cannot be imported.
+        """
+        value = getattr(conf, "MICROSOFT_SSO_AUTHENTICATION_BACKEND")
+        if not isinstance(value, type):
+            value = auth.get_sso_value("AUTHENTICATION_BACKEND")
+        if not value:
+            return None
+        backend_path = get_backend_path(value)
+        try:
+            self.resolve(backend_path)
+        except ImportError as error:
+            raise ImportError(f"Authentication Backend invalid: {backend_path}") from error
+        return backend_path
+
+    def load(self) -> list[tuple[str, str, ImportError]]:
+        """Import all paths set in settings.
+
+        Callable settings depend on the request, so they are resolved on use.
+
+        :return: The setting name, path and error for each path not imported.
+        """
+        self.clear()
+        errors = []
+        for key in HOOK_SETTINGS + BACKEND_SETTINGS:
+            setting_name = f"MICROSOFT_SSO_{key}"
+            value = getattr(conf, setting_name)
+            if not isinstance(value, str) or not value:
+                continue
+            try:
+                self.resolve(value)
+            except ImportError as error:
+                errors.append((setting_name, value, error))
+        return errors
+
+    def clear(self):
+        with self._lock:
+            self._resolved.clear()
+
+
+hook_registry = HookRegistry()
+
+
+def reload_hooks(setting: str, **kwargs):
+    """Resolve the paths again when a hook setting changes (ex. on tests)."""
+    if setting.removeprefix("MICROSOFT_SSO_") in HOOK_SETTINGS + BACKEND_SETTINGS:
+        hook_registry.load()
+
+
+@dataclass
+class SSOProvider:
+    """One installed django-*-sso package, like django_microsoft_sso."""
+
+    name: str
+    conf: Any
+    _urls: dict[tuple[str, Any, str | None], tuple[str, str]] = field(
+        default_factory=dict, repr=False
+    )
+
+    @property
+    def package_name(self) -> str:
+        return f"django_{self.name}_sso"
+
+    def get_setting_name(self, suffix: str) -> str:
+        return f"{self.name.upper()}_SSO_{suffix}"
+
+    def get_setting(self, suffix: str, default: Any = None) -> Any:
+        return getattr(self.conf, self.get_setting_name(suffix), default)
+
+    def get_urls(self) -> tuple[str, str]:
+        """Get the login and button CSS URLs.
+
+        URLs are resolved on first use, after the URLconf is loaded,
+        and kept per script prefix, URLconf and language (for i18n_patterns).
+        """
+        key = (get_script_prefix(), get_urlconf(), get_language())
+        urls = self._urls.get(key)
+        if urls is None:
+            urls = (
+                reverse(f"{self.package_name}:oauth_start_login"),
+                static(f"{self.package_name}/{self.name}_button.css"),
+            )
+            self._urls[key] = urls
+        return urls
+
+
+class ProviderRegistry:
+    """Find the installed django-*-sso packages once, for the sso_tags.
+
+    Packages are found on app ready, and again when the settings change.
+    Settings which depend on the request are read on each use.
+    """
+
+    def __init__(self):
+        self._providers: list[SSOProvider] | None = None
+
+    @property
+    def providers(self) -> list[SSOProvider]:
+        providers = self._providers
+        if providers is None:
+            providers = self.load()
+        return providers
+
+    def load(self) -> list[SSOProvider]:
+        providers = []
+        for app in settings.INSTALLED_APPS:
+            match = PROVIDER_APP_PATTERN.search(app)
+            if not match:
+                continue
+            name = match.group(1)
+            try:
+                provider_conf = importlib.import_module(f"{app}.conf")
+                providers.append(SSOProvider(name=name, conf=provider_conf))
+            except Exception as e:
+                logger.error(f"Error importing {app}: {e}")
+        self._providers = providers
+        return providers
+
+    def clear(self):
+        self._providers = None
+
+
+provider_registry = ProviderRegistry()
+
+
+def reload_providers(setting: str, **kwargs):
+    """Find the providers again when their settings change (ex. on tests)."""
+    if setting in PROVIDER_SETTINGS:
+        provider_registry.clear()
@@ -0,0 +1,25 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+
+SUPERUSER_EXISTS_CACHE_KEY = "django_microsoft_sso:superuser_exists"
+
+
+def clear_superuser_exists_cache(sender, instance, **kwargs):
+    """Forget the cached 'a superuser exists' fact when users change.
+
+    Only the positive result is cached, so it is cleared only by the
+    changes which can remove the last superuser: deleting a superuser,
+    or saving a user which is not a superuser (ex. a demoted one).
+    """
+    if kwargs.get("signal") is post_delete:
+        if not instance.is_superuser:
+            return
+    else:
+        if instance.is_superuser or kwargs.get("created"):
+            # Superusers and new users can't change this fact
+            return
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "is_superuser" not in update_fields:
+            # Ex. the last_login update, on each login
+            return
+    cache.delete(SUPERUSER_EXISTS_CACHE_KEY)
@@ -1,28 +1,17 @@
-import importlib
-import re
 from typing import Callable
 
 from django import template
-from django.conf import settings
 from django.http import HttpRequest
-from django.templatetags.static import static
-from django.urls import reverse
 from loguru import logger
 
 from django_microsoft_sso.helpers import is_admin_path, is_page_path
+from django_microsoft_sso.registry import provider_registry
 
 register = template.Library()
 
 
 @register.simple_tag(takes_context=True)
 def define_sso_providers(context):
-    provider_pattern = re.compile(r"^django_(.+)_sso$")
-    providers = []
-    for app in settings.INSTALLED_APPS:
-        match = re.search(provider_pattern, app)
-        if match:
-            providers.append(match.group(1))
-
     sso_providers = []
     request = context.get("request")
 
@@ -32,23 +21,21 @@ def define_sso_providers(context):
     if request is not None and hasattr(request, "_sso_providers_cache"):
         return request._sso_providers_cache
 
-    for provider in providers:
-        package_name = f"django_{provider}_sso"
+    # The installed providers are found once, on app ready
+    for provider in provider_registry.providers:
         try:
-            package = importlib.import_module(package_name)
-            conf = getattr(package, "conf")
-            sso_enabled_conf = f"{provider.upper()}_SSO_ENABLED"
-            sso_enabled: bool = getattr(conf, sso_enabled_conf)
-            sso_pages_enabled_conf = f"{provider.upper()}_SSO_PAGES_ENABLED"
-            sso_pages_enabled: bool | Callable[[HttpRequest], bool] | None = getattr(
-                conf, sso_pages_enabled_conf, None
+            sso_enabled_conf = provider.get_setting_name("ENABLED")
+            sso_enabled: bool = provider.get_setting("ENABLED")
+            sso_pages_enabled_conf = provider.get_setting_name("PAGES_ENABLED")
+            sso_pages_enabled: bool | Callable[[HttpRequest], bool] | None = (
+                provider.get_setting("PAGES_ENABLED")
             )
-            sso_admin_enabled_conf = f"{provider.upper()}_SSO_ADMIN_ENABLED"
-            sso_admin_enabled: bool | Callable[[HttpRequest], bool] | None = getattr(
-                conf, sso_admin_enabled_conf, None
+            sso_admin_enabled_conf = provider.get_setting_name("ADMIN_ENABLED")
+            sso_admin_enabled: bool | Callable[[HttpRequest], bool] | None = (
+                provider.get_setting("ADMIN_ENABLED")
             )
 
-            provider_name = provider.title()
+            provider_name = provider.name.title()
             if not sso_enabled:
                 logger.debug(
                     f"{provider_name} SSO is Disabled from config: {sso_enabled_conf}"
@@ -96,25 +83,24 @@ def define_sso_providers(context):
                 logger.debug(log_text)
 
             if can_add:
-                logo_conf = f"{provider.upper()}_SSO_LOGO_URL"
-                text_conf = f"{provider.upper()}_SSO_TEXT"
-                logo_conf = getattr(conf, logo_conf)
+                logo_conf = provider.get_setting("LOGO_URL")
                 if callable(logo_conf):
                     logo_conf = logo_conf(request)
-                text_conf = getattr(conf, text_conf)
+                text_conf = provider.get_setting("TEXT")
                 if callable(text_conf):
                     text_conf = text_conf(request)
+                login_url, css_url = provider.get_urls()
                 sso_providers.append(
                     {
-                        "name": provider,
+                        "name": provider.name,
                         "logo_url": logo_conf,
                         "text": text_conf,
-                        "login_url": reverse(f"django_{provider}_sso:oauth_start_login"),
-                        "css_url": static(f"django_{provider}_sso/{provider}_button.css"),
+                        "login_url": login_url,
+                        "css_url": css_url,
                     }
                 )
         except Exception as e:
-            logger.error(f"Error importing {package_name}: {e}")
+            logger.error(f"Error importing {provider.package_name}: {e}")
 
     if request is not None:
         setattr(request, "_sso_providers_cache", sso_providers)
@@ -9,6 +9,7 @@ from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.messages.storage.fallback import FallbackStorage
 from django.contrib.sessions.middleware import SessionMiddleware
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.db import connection, models
 from django.test import AsyncClient
 from django.urls import reverse
@@ -20,6 +21,13 @@ from django_microsoft_sso.main import MicrosoftAuth
 SECRET_PATH = "/secret/"
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
 @pytest.fixture
 def query_string():
     return urlencode(
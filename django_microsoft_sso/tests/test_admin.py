@@ -0,0 +1,43 @@
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from django_microsoft_sso.models import MicrosoftSSOUser
+
+pytestmark = pytest.mark.django_db
+
+
+def create_sso_users(count: int):
+    users = User.objects.bulk_create(
+        User(username=f"user{index}-{count}@dailyplanet.com") for index in range(count)
+    )
+    MicrosoftSSOUser.objects.bulk_create(
+        MicrosoftSSOUser(user=user, microsoft_id=str(user.pk), picture_raw=b"picture")
+        for user in users
+    )
+
+
+def get_changelist_queries(admin_client) -> list[str]:
+    with CaptureQueriesContext(connection) as context:
+        response = admin_client.get(
+            reverse("admin:django_microsoft_sso_microsoftssouser_changelist")
+        )
+    assert response.status_code == 200
+    return [query["sql"] for query in context.captured_queries]
+
+
+def test_changelist_queries_do_not_grow_with_rows(admin_client):
+    # Arrange
+    create_sso_users(1)
+    get_changelist_queries(admin_client)  # warm up the site cache
+    one_row_queries = get_changelist_queries(admin_client)
+    create_sso_users(99)
+
+    # Act
+    queries = get_changelist_queries(admin_client)
+
+    # Assert
+    assert len(queries) == len(one_row_queries)
+    assert not any("picture_raw" in query for query in queries)
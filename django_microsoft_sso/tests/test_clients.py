@@ -0,0 +1,168 @@
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+
+from django_microsoft_sso import clients
+
+
+def test_http_client_is_shared(settings):
+    # Arrange
+    settings.MICROSOFT_SSO_HTTP_MAX_CONNECTIONS = 5
+    clients.close_http_client()
+
+    # Act
+    first_client = clients.get_http_client()
+    second_client = clients.get_http_client()
+
+    # Assert
+    assert first_client is second_client
+    assert first_client._transport._pool._max_connections == 5
+
+
+def test_http_client_after_fork(mocker):
+    # Arrange
+    first_client = clients.get_http_client()
+    mocker.patch("django_microsoft_sso.clients.os.getpid", return_value=-1)
+
+    # Act
+    second_client = clients.get_http_client()
+
+    # Assert
+    assert first_client is not second_client
+
+
+def test_graph_executor_after_fork(mocker):
+    # Arrange
+    executor = clients.get_graph_executor()
+    mocker.patch("django_microsoft_sso.clients.os.getpid", return_value=-1)
+
+    # Act
+    new_executor = clients.get_graph_executor()
+
+    # Assert
+    assert new_executor is not executor
+    assert clients.get_graph_executor() is new_executor
+
+
+def test_graph_executor_max_workers(settings, mocker):
+    # Arrange
+    settings.MICROSOFT_SSO_GRAPH_MAX_WORKERS = 3
+    mocker.patch("django_microsoft_sso.clients.os.getpid", return_value=-2)
+
+    # Act
+    executor = clients.get_graph_executor()
+
+    # Assert
+    assert executor._max_workers == 3
+
+
+def test_graph_call_runs_inline_when_pool_is_busy(settings, mocker):
+    # Arrange
+    settings.MICROSOFT_SSO_GRAPH_MAX_WORKERS = 1
+    mocker.patch("django_microsoft_sso.clients.os.getpid", return_value=-3)
+    release = threading.Event()
+    busy_future = clients.submit_graph_call(release.wait)
+
+    # Act
+    future = clients.submit_graph_call(threading.get_ident)
+
+    # Assert
+    assert future.done()
+    assert future.result() == threading.get_ident()
+    release.set()
+    assert busy_future.result(timeout=1) is True
+
+
+def test_discovery_executor_is_not_the_graph_executor():
+    # Act
+    discovery_executor = clients.get_discovery_executor()
+
+    # Assert
+    assert discovery_executor is not clients.get_graph_executor()
+    assert clients.get_discovery_executor() is discovery_executor
+
+
+def test_async_http_client_is_closed_with_its_loop():
+    # Arrange
+    async def get_client():
+        client = clients.get_async_http_client()
+        assert clients.get_async_http_client() is client
+        return client
+
+    # Act
+    client = async_to_sync(get_client)()
+
+    # Assert
+    assert client.is_closed
+
+
+def test_msal_app_registry(settings, mocker):
+    # Arrange
+    settings.MICROSOFT_SSO_MSAL_CACHE_SIZE = 2
+    clients.clear_msal_apps()
+    mock_app = mocker.patch(
+        "django_microsoft_sso.clients.msal.ConfidentialClientApplication"
+    )
+    mock_app.side_effect = lambda **kwargs: mocker.Mock()
+    authority = "https://login.microsoftonline.com/contoso"
+
+    # Act
+    first_app = clients.get_msal_app("foo", "secret", authority)
+    same_app = clients.get_msal_app("foo", "secret", authority)
+    other_secret_app = clients.get_msal_app("foo", "other-secret", authority)
+    clients.get_msal_app("bar", "secret", authority)
+    evicted_app = clients.get_msal_app("foo", "secret", authority)
+
+    # Assert
+    assert first_app is same_app
+    assert first_app is not other_secret_app
+    assert first_app is not evicted_app
+    assert mock_app.call_count == 4
+
+
+def test_discovery_cache(settings, mocker):
+    # Arrange
+    settings.MICROSOFT_SSO_DISCOVERY_CACHE_TTL = 60
+    cache.clear()
+    session = mocker.Mock()
+    session.get.return_value = mocker.Mock(status_code=200, text='{"issuer": "foo"}')
+    http_client = clients.DiscoveryCacheHttpClient(session)
+    url = "https://login.microsoftonline.com/contoso/v2.0/.well-known/openid-configuration"
+
+    # Act
+    first_response = http_client.get(url)
+    second_response = http_client.get(url)
+    other_response = http_client.get("https://login.microsoftonline.com/contoso/foo")
+
+    # Assert
+    assert first_response.text == second_response.text == '{"issuer": "foo"}'
+    assert isinstance(second_response, clients.CachedResponse)
+    assert other_response is session.get.return_value
+    assert session.get.call_count == 2
+
+
+def test_discovery_cache_stale_while_revalidate(settings, mocker):
+    # Arrange
+    settings.MICROSOFT_SSO_DISCOVERY_CACHE_TTL = 60
+    cache.clear()
+    session = mocker.Mock()
+    session.get.return_value = mocker.Mock(status_code=200, text='{"issuer": "new"}')
+    http_client = clients.DiscoveryCacheHttpClient(session)
+    url = "https://login.microsoftonline.com/contoso/v2.0/.well-known/openid-configuration"
+    key = http_client.get_cache_key(url, None)
+    cache.set(key, {"text": '{"issuer": "old"}', "stored_at": time.time() - 120})
+    executor = mocker.patch(
+        "django_microsoft_sso.clients.get_discovery_executor"
+    ).return_value
+    executor.submit.side_effect = lambda fn, *args: fn(*args)
+
+    # Act
+    stale_response = http_client.get(url)
+    fresh_response = http_client.get(url)
+
+    # Assert
+    assert stale_response.text == '{"issuer": "old"}'
+    assert fresh_response.text == '{"issuer": "new"}'
+    assert session.get.call_count == 1
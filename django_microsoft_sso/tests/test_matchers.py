@@ -0,0 +1,133 @@
+import pytest
+
+from django_microsoft_sso.matchers import (
+    DomainMatcher,
+    PermissionIndex,
+    PermissionLoader,
+    get_domain_matcher,
+    get_permission_index,
+)
+
+
+@pytest.mark.parametrize(
+    "domains, domain, expected_result",
+    [
+        (["*"], "anything.com", True),
+        (["corp.com"], "corp.com", True),
+        (["corp.com"], "CORP.com", True),
+        (["corp.com"], "notcorp.com", False),
+        (["corp.com"], "orp.com", False),
+        (["corp.com"], "mail.corp.com", False),
+        (["*.corp.com"], "mail.corp.com", True),
+        (["*.corp.com"], "a.mail.corp.com", True),
+        (["*.corp.com"], "corp.com", False),
+        (["*.corp.com"], "mail.notcorp.com", False),
+        (["@Corp.com"], "corp.com", True),
+        ([], "corp.com", False),
+    ],
+)
+def test_domain_matcher(domains, domain, expected_result):
+    # Act
+    matcher = DomainMatcher.from_domains(domains)
+
+    # Assert
+    assert matcher.match(domain) is expected_result
+
+
+def test_domain_matcher_is_cached():
+    # Arrange
+    domains = ["corp.com", "*.partner.com"]
+
+    # Act
+    matcher = get_domain_matcher(domains)
+
+    # Assert
+    assert get_domain_matcher(domains) is matcher
+    assert get_domain_matcher(list(domains)) is matcher
+
+
+def test_domain_matcher_for_list_changed_in_place():
+    # Arrange
+    domains = ["corp.com"]
+    matcher = get_domain_matcher(domains)
+
+    # Act
+    domains.append("partner.com")
+
+    # Assert
+    assert not matcher.match("partner.com")
+    assert get_domain_matcher(domains).match("partner.com")
+
+
+@pytest.mark.parametrize(
+    "entries, values, expected_result",
+    [
+        (["*"], ("clark@dailyplanet.com",), True),
+        (["Clark@DailyPlanet.com"], ("clark@dailyplanet.com",), True),
+        (["clark@dailyplanet.com"], ("lois@dailyplanet.com",), False),
+        (["kalel"], ("clark@dailyplanet.com", "kalel"), True),
+        (["@dailyplanet.com"], ("clark@dailyplanet.com",), True),
+        (["*@dailyplanet.com"], ("clark@notdailyplanet.com",), False),
+        (["*@*.dailyplanet.com"], ("clark@news.dailyplanet.com",), True),
+        (["admin-*@dailyplanet.com"], ("admin-clark@dailyplanet.com",), True),
+        (["admin-*@dailyplanet.com"], ("clark@dailyplanet.com",), False),
+        ([], ("clark@dailyplanet.com", None), False),
+    ],
+)
+def test_permission_index(entries, values, expected_result):
+    # Act
+    index = PermissionIndex.from_entries(entries)
+
+    # Assert
+    assert index.match(*values) is expected_result
+
+
+def test_superuser_list_ignores_all_users_entry():
+    # Act
+    index = get_permission_index("SUPERUSER_LIST", ["*", "@dailyplanet.com"])
+
+    # Assert
+    assert index.match("clark@dailyplanet.com")
+    assert not index.match("lex@lexcorp.com")
+
+
+def test_permission_loader_is_abstract():
+    # Arrange
+    class IncompleteLoader(PermissionLoader):
+        def load(self, name):
+            return []
+
+    # Act / Assert
+    with pytest.raises(TypeError):
+        IncompleteLoader()
+
+
+class FakePermissionLoader(PermissionLoader):
+    version = 1
+    entries = {"STAFF_LIST": ["clark@dailyplanet.com"]}
+
+    def get_version(self):
+        return self.version
+
+    def load(self, name):
+        return self.entries.get(name, [])
+
+
+def test_permission_index_with_loader():
+    # Arrange
+    loader_path = "django_microsoft_sso.tests.test_matchers.FakePermissionLoader"
+    entries = ["lois@dailyplanet.com"]
+    index = get_permission_index("STAFF_LIST", entries, loader_path)
+    assert index.match("clark@dailyplanet.com")
+
+    # Act
+    FakePermissionLoader.entries = {"STAFF_LIST": ["jimmy@dailyplanet.com"]}
+    cached_index = get_permission_index("STAFF_LIST", entries, loader_path)
+    FakePermissionLoader.version = 2
+    new_index = get_permission_index("STAFF_LIST", entries, loader_path)
+
+    # Assert
+    assert cached_index is index
+    assert new_index.match("jimmy@dailyplanet.com")
+    assert new_index.match("lois@dailyplanet.com")
+    assert not new_index.match("clark@dailyplanet.com")
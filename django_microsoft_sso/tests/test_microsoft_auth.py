@@ -1,9 +1,18 @@
+import base64
+import hashlib
+import time
+
+import httpx
 import pytest
+from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from msal.authority import AZURE_PUBLIC, AuthorityBuilder
 
 from django_microsoft_sso import conf
 from django_microsoft_sso.main import MicrosoftAuth
+from django_microsoft_sso.models import MicrosoftSSOUser
 
 pytestmark = pytest.mark.django_db
 
@@ -104,3 +113,264 @@ def test_get_redirect_uri_from_multiple_reverse_proxies(rf, query_string, monkey
         ms.get_redirect_uri()
         == f"{expected_scheme}://{current_site_domain}/microsoft_sso/callback/"
     )
+
+
+def graph_get_side_effect(url, **kwargs):
+    request = httpx.Request("GET", url)
+    if url.endswith("$select=mailVerified"):
+        return httpx.Response(200, json={"mailVerified": True}, request=request)
+    if "/photo" in url:
+        return httpx.Response(200, content=b"picture", request=request)
+    return httpx.Response(200, json={"id": "abc", "mail": "foo@bar.com"}, request=request)
+
+
+@pytest.mark.parametrize("fetch_mode", ["sequential", "parallel"])
+def test_get_user_info(fetch_mode, callback_request, settings, mocker):
+    # Arrange
+    settings.MICROSOFT_SSO_GRAPH_FETCH_MODE = fetch_mode
+    mock_client = mocker.patch("django_microsoft_sso.main.get_http_client").return_value
+    mock_client.get.side_effect = graph_get_side_effect
+    ms = MicrosoftAuth(callback_request, token_info={"access_token": "foo"})
+
+    # Act
+    user_info = ms.get_user_info()
+
+    # Assert
+    assert mock_client.get.call_count == 3
+    assert user_info == {
+        "id": "abc",
+        "mail": "foo@bar.com",
+        "email_verified": True,
+        "picture_raw_data": b"picture",
+        "picture_etag": hashlib.sha256(b"picture").hexdigest(),
+        "picture_not_modified": False,
+    }
+
+
+def test_get_user_info_parallel_timeout(callback_request, settings, mocker):
+    # Arrange
+    def slow_side_effect(url, **kwargs):
+        if "/photo" in url:
+            time.sleep(0.5)
+        return graph_get_side_effect(url, **kwargs)
+
+    settings.MICROSOFT_SSO_GRAPH_FETCH_MODE = "parallel"
+    settings.MICROSOFT_SSO_GRAPH_TIMEOUT = 0.1
+    mock_client = mocker.patch("django_microsoft_sso.main.get_http_client").return_value
+    mock_client.get.side_effect = slow_side_effect
+    ms = MicrosoftAuth(callback_request, token_info={"access_token": "foo"})
+
+    # Act/Assert
+    with pytest.raises(TimeoutError):
+        ms.get_user_info()
+
+
+@pytest.mark.parametrize("picture_status, expected_get_calls", [(200, 0), (503, 1)])
+def test_get_user_info_batch(
+    picture_status, expected_get_calls, callback_request, settings, mocker
+):
+    # Arrange
+    settings.MICROSOFT_SSO_GRAPH_FETCH_MODE = "batch"
+    picture_item = {
+        "id": "picture",
+        "status": picture_status,
+        "headers": {"Content-Type": "image/jpeg"},
+        "body": base64.b64encode(b"picture").decode(),
+    }
+    if picture_status != 200:
+        picture_item = {"id": "picture", "status": picture_status, "body": {}}
+    batch_response = httpx.Response(
+        200,
+        json={
+            "responses": [
+                {
+                    "id": "me",
+                    "status": 200,
+                    "headers": {"Content-Type": "application/json"},
+                    "body": {"id": "abc", "mail": "foo@bar.com"},
+                },
+                {
+                    "id": "email_verified",
+                    "status": 200,
+                    "headers": {"Content-Type": "application/json"},
+                    "body": {"mailVerified": True},
+                },
+                picture_item,
+            ]
+        },
+    )
+    mock_client = mocker.patch("django_microsoft_sso.main.get_http_client").return_value
+    mock_client.post.return_value = batch_response
+    mock_client.get.side_effect = graph_get_side_effect
+    ms = MicrosoftAuth(callback_request, token_info={"access_token": "foo"})
+
+    # Act
+    user_info = ms.get_user_info()
+
+    # Assert
+    assert mock_client.post.call_count == 1
+    assert mock_client.get.call_count == expected_get_calls
+    assert user_info == {
+        "id": "abc",
+        "mail": "foo@bar.com",
+        "email_verified": True,
+        "picture_raw_data": b"picture",
+        "picture_etag": hashlib.sha256(b"picture").hexdigest(),
+        "picture_not_modified": False,
+    }
+
+
+def test_get_user_info_batch_fallback(callback_request, settings, mocker):
+    # Arrange
+    settings.MICROSOFT_SSO_GRAPH_FETCH_MODE = "batch"
+    mock_client = mocker.patch("django_microsoft_sso.main.get_http_client").return_value
+    mock_client.post.return_value = httpx.Response(
+        200, json={"responses": [{"id": "me", "status": 503, "body": {}}]}
+    )
+    mock_client.get.side_effect = graph_get_side_effect
+    ms = MicrosoftAuth(callback_request, token_info={"access_token": "foo"})
+
+    # Act
+    user_info = ms.get_user_info()
+
+    # Assert
+    assert mock_client.get.call_count == 3
+    assert user_info["picture_raw_data"] == b"picture"
+
+
+def pre_create_with_fields(ms_user_info, request):
+    return {}
+
+
+pre_create_with_fields.graph_fields = ["jobTitle", "id"]
+
+
+@pytest.mark.parametrize(
+    "user_fields, expected_me_path",
+    [
+        (["id", "mail"], "/me?$select=id,mail,jobTitle"),
+        (None, "/me"),
+    ],
+)
+def test_graph_user_fields(user_fields, expected_me_path, callback_request, settings):
+    # Arrange
+    settings.MICROSOFT_SSO_GRAPH_USER_FIELDS = user_fields
+    settings.MICROSOFT_SSO_PRE_CREATE_CALLBACK = (
+        "django_microsoft_sso.tests.test_microsoft_auth.pre_create_with_fields"
+    )
+    ms = MicrosoftAuth(callback_request, token_info={"access_token": "foo"})
+
+    # Act
+    options = ms.get_graph_options()
+
+    # Assert
+    assert options.me_path == expected_me_path
+
+
+def test_get_user_info_picture_not_modified(
+    callback_request, microsoft_response, settings, mocker
+):
+    # Arrange
+    def side_effect(url, headers, **kwargs):
+        if "/photo" in url and headers.get("If-None-Match") == "etag-1":
+            return httpx.Response(304)
+        return graph_get_side_effect(url, **kwargs)
+
+    user = User.objects.create(username="foo", email="foo@bar.com")
+    MicrosoftSSOUser.objects.create(
+        user=user, microsoft_id="abc", picture_raw=b"old", picture_etag="etag-1"
+    )
+    mock_client = mocker.patch("django_microsoft_sso.main.get_http_client").return_value
+    mock_client.get.side_effect = side_effect
+    ms = MicrosoftAuth(
+        callback_request,
+        token_info={"access_token": "foo", "id_token_claims": {"oid": "abc"}},
+    )
+
+    # Act
+    user_info = ms.get_user_info()
+
+    # Assert
+    assert user_info["picture_not_modified"] is True
+    assert "picture_raw_data" not in user_info
+
+
+def test_get_user_info_batch_picture_not_modified(callback_request, settings, mocker):
+    # Arrange
+    settings.MICROSOFT_SSO_GRAPH_FETCH_MODE = "batch"
+    user = User.objects.create(username="foo", email="foo@bar.com")
+    MicrosoftSSOUser.objects.create(
+        user=user, microsoft_id="abc", picture_raw=b"old", picture_etag="etag-1"
+    )
+    mock_client = mocker.patch("django_microsoft_sso.main.get_http_client").return_value
+    mock_client.post.return_value = httpx.Response(
+        200,
+        json={
+            "responses": [
+                {
+                    "id": "me",
+                    "status": 200,
+                    "headers": {"Content-Type": "application/json"},
+                    "body": {"id": "abc", "mail": "foo@bar.com"},
+                },
+                {
+                    "id": "email_verified",
+                    "status": 200,
+                    "headers": {"Content-Type": "application/json"},
+                    "body": {"mailVerified": True},
+                },
+                {"id": "picture", "status": 304},
+            ]
+        },
+    )
+    ms = MicrosoftAuth(
+        callback_request,
+        token_info={"access_token": "foo", "id_token_claims": {"oid": "abc"}},
+    )
+
+    # Act
+    with CaptureQueriesContext(connection) as context:
+        user_info = ms.get_user_info()
+
+    # Assert
+    payload = mock_client.post.call_args.kwargs["json"]
+    picture_request = [item for item in payload["requests"] if item["id"] == "picture"][0]
+    assert picture_request["headers"] == {"If-None-Match": "etag-1"}
+    assert user_info["picture_not_modified"] is True
+    assert len(context.captured_queries) == 1
+
+
+def test_picture_etag_from_hash(callback_request, mocker):
+    # Arrange
+    mock_client = mocker.patch("django_microsoft_sso.main.get_http_client").return_value
+    mock_client.get.side_effect = graph_get_side_effect
+    ms = MicrosoftAuth(callback_request, token_info={"access_token": "foo"})
+
+    # Act
+    user_info = ms.get_user_info()
+
+    # Assert
+    assert user_info["picture_etag"] == hashlib.sha256(b"picture").hexdigest()
+    assert user_info["picture_not_modified"] is False
+
+
+def test_get_user_info_picture_size_fallback(callback_request, settings, mocker):
+    # Arrange
+    def side_effect(url, **kwargs):
+        if "/photos/96x96/" in url:
+            return httpx.Response(404)
+        return graph_get_side_effect(url, **kwargs)
+
+    settings.MICROSOFT_SSO_PICTURE_SIZE = "96x96"
+    mock_client = mocker.patch("django_microsoft_sso.main.get_http_client").return_value
+    mock_client.get.side_effect = side_effect
+    ms = MicrosoftAuth(callback_request, token_info={"access_token": "foo"})
+
+    # Act
+    user_info = ms.get_user_info()
+
+    # Assert
+    called_urls = [call.args[0] for call in mock_client.get.call_args_list]
+    assert "https://graph.microsoft.com/v1.0/me/photos/96x96/$value" in called_urls
+    assert "https://graph.microsoft.com/v1.0/me/photo/$value" in called_urls
+    assert user_info["picture_raw_data"] == b"picture"
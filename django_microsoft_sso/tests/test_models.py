@@ -1,6 +1,10 @@
+from io import BytesIO, StringIO
+
 import pytest
+from django.core.management import call_command
 
 from django_microsoft_sso.main import UserHelper
+from django_microsoft_sso.models import MicrosoftSSOUser, User
 
 pytestmark = pytest.mark.django_db(transaction=True)
 
@@ -16,6 +20,43 @@ def test_microsoft_sso_model(microsoft_response, callback_request):
     assert user.microsoftssouser.locale == microsoft_response["preferredLanguage"]
 
 
+def test_picture_not_modified(microsoft_response, callback_request):
+    # Arrange
+    UserHelper(microsoft_response, callback_request).get_or_create_user()
+    not_modified_response = {
+        **microsoft_response,
+        "picture_raw_data": None,
+        "picture_not_modified": True,
+    }
+
+    # Act
+    helper = UserHelper(not_modified_response, callback_request)
+    user = helper.get_or_create_user()
+
+    # Assert
+    user.microsoftssouser.refresh_from_db()
+    assert user.microsoftssouser.picture_raw == microsoft_response["picture_raw_data"]
+
+
+def test_picture_with_stored_etag_is_not_rewritten(
+    microsoft_response, callback_request, mocker
+):
+    # Arrange
+    first_response = {**microsoft_response, "picture_etag": "etag-1"}
+    UserHelper(first_response, callback_request).get_or_create_user()
+    same_picture_response = {**first_response, "picture_raw_data": b"same picture"}
+    get_picture_fields = mocker.spy(UserHelper, "get_picture_fields")
+
+    # Act
+    helper = UserHelper(same_picture_response, callback_request)
+    user = helper.get_or_create_user()
+
+    # Assert
+    user.microsoftssouser.refresh_from_db()
+    assert get_picture_fields.call_count == 0
+    assert user.microsoftssouser.picture_raw == microsoft_response["picture_raw_data"]
+
+
 def test_user_with_custom_field_names(
     custom_user_model, microsoft_response, callback_request
 ):
@@ -29,3 +70,176 @@ def test_user_with_custom_field_names(
     # Assert
     assert user.user_name == "kalel@dailyplanet.com"
     assert user.mail == "kalel@dailyplanet.com"
+
+
+@pytest.fixture
+def picture_storage(settings, tmp_path):
+    settings.STORAGES = {
+        **settings.STORAGES,
+        "sso_pictures": {
+            "BACKEND": "django.core.files.storage.FileSystemStorage",
+            "OPTIONS": {"location": str(tmp_path), "base_url": "/media/"},
+        },
+    }
+    settings.MICROSOFT_SSO_PICTURE_STORAGE = "sso_pictures"
+    return tmp_path
+
+
+def test_picture_saved_in_storage(picture_storage, microsoft_response, callback_request):
+    # Arrange
+    microsoft_response["picture_raw_data"] = b"\x89PNG\r\n\x1a\nfoo"
+
+    # Act
+    helper = UserHelper(microsoft_response, callback_request)
+    user = helper.get_or_create_user()
+
+    # Assert
+    sso_user = user.microsoftssouser
+    assert sso_user.picture_raw is None
+    assert sso_user.picture_path.startswith("django_microsoft_sso/pictures/")
+    assert sso_user.picture_path.endswith(".png")
+    assert (picture_storage / sso_user.picture_path).read_bytes() == (
+        b"\x89PNG\r\n\x1a\nfoo"
+    )
+    assert sso_user.picture_url == f"/media/{sso_user.picture_path}"
+    assert sso_user.picture_url in sso_user.picture
+
+
+def test_old_picture_is_deleted_from_storage(
+    picture_storage, microsoft_response, callback_request
+):
+    # Arrange
+    microsoft_response["picture_raw_data"] = b"\x89PNG\r\n\x1a\nfoo"
+    user = UserHelper(microsoft_response, callback_request).get_or_create_user()
+    old_path = user.microsoftssouser.picture_path
+
+    # Act
+    microsoft_response["picture_raw_data"] = b"\x89PNG\r\n\x1a\nbar"
+    user = UserHelper(microsoft_response, callback_request).get_or_create_user()
+
+    # Assert
+    new_path = MicrosoftSSOUser.objects.get(user=user).picture_path
+    assert new_path != old_path
+    assert (picture_storage / new_path).exists()
+    assert not (picture_storage / old_path).exists()
+
+
+def test_user_principal_name_is_saved_lowercase(microsoft_response, callback_request):
+    # Arrange
+    user = UserHelper(microsoft_response, callback_request).get_or_create_user()
+    sso_user = user.microsoftssouser
+
+    # Act
+    sso_user.user_principal_name = "KalEl@DailyPlanet.com"
+    sso_user.save()
+
+    # Assert
+    sso_user.refresh_from_db()
+    assert sso_user.user_principal_name == "kalel@dailyplanet.com"
+
+
+def test_picture_is_resized(microsoft_response, callback_request, settings):
+    # Arrange
+    Image = pytest.importorskip("PIL.Image")
+    picture = BytesIO()
+    Image.new("RGB", (300, 200), "blue").save(picture, format="JPEG")
+    microsoft_response["picture_raw_data"] = picture.getvalue()
+    settings.MICROSOFT_SSO_PICTURE_SIZE = "96x96"
+
+    # Act
+    helper = UserHelper(microsoft_response, callback_request)
+    user = helper.get_or_create_user()
+
+    # Assert
+    stored_picture = Image.open(BytesIO(user.microsoftssouser.picture_raw))
+    assert stored_picture.size == (96, 64)
+    assert stored_picture.format == "JPEG"
+
+
+def test_picture_is_converted(microsoft_response, callback_request, settings):
+    # Arrange
+    Image = pytest.importorskip("PIL.Image")
+    picture = BytesIO()
+    Image.new("RGB", (96, 96), "blue").save(picture, format="PNG")
+    microsoft_response["picture_raw_data"] = picture.getvalue()
+    settings.MICROSOFT_SSO_PICTURE_FORMAT = "webp"
+
+    # Act
+    helper = UserHelper(microsoft_response, callback_request)
+    user = helper.get_or_create_user()
+
+    # Assert
+    sso_user = user.microsoftssouser
+    assert sso_user.picture_content_type == "image/webp"
+    assert Image.open(BytesIO(sso_user.picture_raw)).format == "WEBP"
+    assert sso_user.picture_url.startswith("/microsoft_sso/avatar/")
+
+
+def test_convert_microsoft_pictures(microsoft_response, callback_request):
+    # Arrange
+    Image = pytest.importorskip("PIL.Image")
+    picture = BytesIO()
+    Image.new("RGB", (300, 300), "blue").save(picture, format="PNG")
+    microsoft_response["picture_raw_data"] = picture.getvalue()
+    user = UserHelper(microsoft_response, callback_request).get_or_create_user()
+    out = StringIO()
+
+    # Act
+    call_command("convert_microsoft_pictures", format="webp", size="96x96", stdout=out)
+
+    # Assert
+    sso_user = MicrosoftSSOUser.objects.get(user=user)
+    stored_picture = Image.open(BytesIO(sso_user.picture_raw))
+    assert "Pictures converted: 1" in out.getvalue()
+    assert sso_user.picture_content_type == "image/webp"
+    assert stored_picture.format == "WEBP"
+    assert stored_picture.size == (96, 96)
+
+
+def test_convert_microsoft_pictures_shared_file(
+    picture_storage, microsoft_response, callback_request
+):
+    # Arrange
+    Image = pytest.importorskip("PIL.Image")
+    picture = BytesIO()
+    Image.new("RGB", (96, 96), "blue").save(picture, format="PNG")
+    microsoft_response["picture_raw_data"] = picture.getvalue()
+    microsoft_response["picture_etag"] = '"graph-etag"'
+    user = UserHelper(microsoft_response, callback_request).get_or_create_user()
+    old_sso_user = MicrosoftSSOUser.objects.get(user=user)
+    other_user = User.objects.create(username="lois@dailyplanet.com")
+    MicrosoftSSOUser.objects.create(
+        user=other_user,
+        picture_path=old_sso_user.picture_path,
+        picture_etag=old_sso_user.picture_etag,
+    )
+
+    # Act
+    call_command(
+        "convert_microsoft_pictures", format="webp", batch_size=1, stdout=StringIO()
+    )
+
+    # Assert
+    sso_users = list(MicrosoftSSOUser.objects.order_by("pk"))
+    assert sso_users[0].picture_path == sso_users[1].picture_path
+    assert sso_users[0].picture_path != old_sso_user.picture_path
+    assert sso_users[0].picture_etag != old_sso_user.picture_etag
+    assert (picture_storage / sso_users[0].picture_path).exists()
+    assert not (picture_storage / old_sso_user.picture_path).exists()
+
+
+def test_convert_microsoft_pictures_changes_version(microsoft_response, callback_request):
+    # Arrange
+    Image = pytest.importorskip("PIL.Image")
+    picture = BytesIO()
+    Image.new("RGB", (96, 96), "blue").save(picture, format="PNG")
+    microsoft_response["picture_raw_data"] = picture.getvalue()
+    microsoft_response["picture_etag"] = '"graph-etag"'
+    user = UserHelper(microsoft_response, callback_request).get_or_create_user()
+    old_url = user.microsoftssouser.picture_url
+
+    # Act
+    call_command("convert_microsoft_pictures", format="webp", stdout=StringIO())
+
+    # Assert
+    assert MicrosoftSSOUser.objects.get(user=user).picture_url != old_url
@@ -0,0 +1,112 @@
+import importlib
+
+import pytest
+from django.contrib.auth.backends import ModelBackend
+from django.core.checks import run_checks
+
+from django_microsoft_sso import hooks
+from django_microsoft_sso.main import MicrosoftAuth
+from django_microsoft_sso.registry import hook_registry
+from django_microsoft_sso.tests.conftest import SECRET_PATH
+
+
+def test_hook_path_is_imported_once(settings, rf, mocker):
+    # Arrange
+    settings.MICROSOFT_SSO_PRE_LOGIN_CALLBACK = "django_microsoft_sso.hooks.pre_login_user"
+    import_spy = mocker.spy(importlib, "import_module")
+
+    # Act
+    hook_list = [
+        hook_registry.get_hook("PRE_LOGIN_CALLBACK", MicrosoftAuth(rf.get("/")))
+        for _ in range(3)
+    ]
+
+    # Assert
+    assert hook_list == [hooks.pre_login_user] * 3
+    assert import_spy.call_count == 0
+
+
+def test_hook_callable_setting(settings, rf):
+    # Arrange
+    settings.MICROSOFT_SSO_PRE_CREATE_CALLBACK = hooks.pre_create_user
+
+    # Act
+    hook = hook_registry.get_hook("PRE_CREATE_CALLBACK", MicrosoftAuth(rf.get("/")))
+
+    # Assert
+    assert hook is hooks.pre_create_user
+
+
+def test_hook_path_from_request_callable(settings, rf):
+    # Arrange
+    def get_pre_create_callback(request):
+        return "django_microsoft_sso.hooks.pre_create_user"
+
+    settings.MICROSOFT_SSO_PRE_CREATE_CALLBACK = get_pre_create_callback
+
+    # Act
+    hook = hook_registry.get_hook("PRE_CREATE_CALLBACK", MicrosoftAuth(rf.get("/")))
+
+    # Assert
+    assert hook is hooks.pre_create_user
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [ModelBackend, "django.contrib.auth.backends.ModelBackend"],
+)
+def test_backend_setting(settings, rf, backend):
+    # Arrange
+    settings.MICROSOFT_SSO_AUTHENTICATION_BACKEND = backend
+
+    # Act
+    backend_path = hook_registry.get_backend(MicrosoftAuth(rf.get("/")))
+
+    # Assert
+    assert backend_path == "django.contrib.auth.backends.ModelBackend"
+
+
+def test_invalid_backend(settings, rf):
+    # Arrange
+    settings.MICROSOFT_SSO_AUTHENTICATION_BACKEND = "django.contrib.auth.backends.Foo"
+
+    # Act / Assert
+    with pytest.raises(ImportError, match="Authentication Backend invalid"):
+        hook_registry.get_backend(MicrosoftAuth(rf.get("/")))
+
+
+def test_check_reports_invalid_hook(settings):
+    # Arrange
+    settings.MICROSOFT_SSO_PRE_LOGIN_CALLBACK = "myapp.hooks.missing"
+    settings.MICROSOFT_SSO_PRE_CREATE_CALLBACK = hooks.pre_create_user
+    settings.MICROSOFT_SSO_PRE_VALIDATE_CALLBACK = (
+        "django_microsoft_sso.hooks.pre_validate_user"
+    )
+
+    # Act
+    errors = [error for error in run_checks() if error.id == "microsoft_sso.E001"]
+
+    # Assert
+    assert len(errors) == 1
+    assert "MICROSOFT_SSO_PRE_LOGIN_CALLBACK" in errors[0].msg
+
+
+@pytest.mark.django_db
+def test_login_with_callable_hooks(client_with_session, callback_url, settings, mocker):
+    # Arrange
+    flow_mock = mocker.patch.object(MicrosoftAuth, "auth")
+    flow_mock.acquire_token_by_auth_code_flow.return_value = {"access_token": "foo"}
+    settings.MICROSOFT_SSO_ALLOWABLE_DOMAINS = ["dailyplanet.com"]
+    pre_login_calls = []
+    settings.MICROSOFT_SSO_PRE_VALIDATE_CALLBACK = lambda user_info, request: True
+    settings.MICROSOFT_SSO_PRE_LOGIN_CALLBACK = (
+        lambda user, request: pre_login_calls.append(user)
+    )
+
+    # Act
+    response = client_with_session.get(callback_url)
+
+    # Assert
+    assert response.status_code == 302
+    assert response.url == SECRET_PATH
+    assert pre_login_calls == [response.wsgi_request.user]
@@ -0,0 +1,217 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+
+from django_microsoft_sso.main import MicrosoftAuth
+from django_microsoft_sso.models import MicrosoftSSOSyncState, MicrosoftSSOUser
+from django_microsoft_sso.provisioning import get_command_request
+
+pytestmark = pytest.mark.django_db
+
+GRAPH_USERS = [
+    {
+        "id": "id-clark",
+        "userPrincipalName": "Kalel@DailyPlanet.com",
+        "mail": "kalel@dailyplanet.com",
+        "givenName": "Clark",
+        "surname": "Kent",
+        "preferredLanguage": "en-US",
+    },
+    {
+        "id": "id-lois",
+        "userPrincipalName": "lois@dailyplanet.com",
+        "mail": "lois@dailyplanet.com",
+        "givenName": "Lois",
+        "surname": "Lane",
+        "preferredLanguage": "en-US",
+    },
+    {
+        "id": "id-lex",
+        "userPrincipalName": "lex@lexcorp.com",
+        "mail": "lex@lexcorp.com",
+        "givenName": "Lex",
+        "surname": "Luthor",
+        "preferredLanguage": "en-US",
+    },
+]
+
+DELTA_CHANGES = [
+    {"id": "id-clark", "surname": "Kent-Lane", "accountEnabled": True},
+    {"id": "id-lois", "@removed": {"reason": "changed"}},
+]
+
+
+@pytest.fixture
+def fake_graph():
+    received_requests = []
+
+    class FakeGraphHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            received_requests.append(
+                {"path": self.path, "authorization": self.headers["Authorization"]}
+            )
+            base_url = f"http://{self.headers['Host']}/v1.0"
+            if "$deltatoken=expired" in self.path:
+                self.send_response(410)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if "$deltatoken=first" in self.path:
+                body = {
+                    "value": DELTA_CHANGES,
+                    "@odata.deltaLink": f"{base_url}/users/delta?$deltatoken=second",
+                }
+            elif self.path.startswith("/v1.0/users/delta"):
+                body = {
+                    "value": GRAPH_USERS,
+                    "@odata.deltaLink": f"{base_url}/users/delta?$deltatoken=first",
+                }
+            elif "$skiptoken=page2" in self.path:
+                body = {"value": GRAPH_USERS[2:]}
+            else:
+                body = {
+                    "value": GRAPH_USERS[:2],
+                    "@odata.nextLink": f"{base_url}/users?$skiptoken=page2",
+                }
+            content = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGraphHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/v1.0", received_requests
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sync_settings(settings, mocker):
+    settings.MICROSOFT_SSO_ALLOWABLE_DOMAINS = ["dailyplanet.com"]
+    settings.MICROSOFT_SSO_PRE_VALIDATE_CALLBACK = (
+        "django_microsoft_sso.hooks.pre_validate_user"
+    )
+    settings.MICROSOFT_SSO_PRE_CREATE_CALLBACK = (
+        "django_microsoft_sso.hooks.pre_create_user"
+    )
+    settings.MICROSOFT_SSO_STAFF_LIST = ["lois@dailyplanet.com"]
+    settings.MICROSOFT_SSO_SUPERUSER_LIST = []
+    settings.MICROSOFT_SSO_UNIQUE_EMAIL = False
+    settings.MICROSOFT_SSO_ALWAYS_UPDATE_USER_DATA = True
+    settings.MICROSOFT_SSO_SAVE_BASIC_MICROSOFT_INFO = True
+    mocker.patch.object(MicrosoftAuth, "get_app_token", return_value="app-token")
+    return settings
+
+
+def test_sync_microsoft_users(fake_graph, sync_settings):
+    # Arrange
+    graph_api_url, received_requests = fake_graph
+    User.objects.create(username="lois@dailyplanet.com", first_name="Lo")
+    out = StringIO()
+
+    # Act
+    call_command(
+        "sync_microsoft_users", graph_api_url=graph_api_url, page_size=2, stdout=out
+    )
+
+    # Assert
+    assert "Users created: 1, updated: 1, deactivated: 0, skipped: 1" in out.getvalue()
+    assert len(received_requests) == 2
+    assert received_requests[0]["path"].startswith("/v1.0/users?$top=2&$select=id,")
+    assert received_requests[0]["authorization"] == "Bearer app-token"
+
+    clark = User.objects.get(username="kalel@dailyplanet.com")
+    assert clark.first_name == "Clark"
+    assert clark.email == "kalel@dailyplanet.com"
+    assert not clark.has_usable_password()
+    assert clark.microsoftssouser.microsoft_id == "id-clark"
+
+    lois = User.objects.get(username="lois@dailyplanet.com")
+    assert lois.first_name == "Lois"
+    assert lois.is_staff is True
+    assert lois.microsoftssouser.user_principal_name == "lois@dailyplanet.com"
+
+    assert not User.objects.filter(username="lex@lexcorp.com").exists()
+    assert MicrosoftSSOUser.objects.count() == 2
+
+
+def test_sync_microsoft_users_is_idempotent(fake_graph, sync_settings):
+    # Arrange
+    graph_api_url, _ = fake_graph
+    call_command("sync_microsoft_users", graph_api_url=graph_api_url, stdout=StringIO())
+    out = StringIO()
+
+    # Act
+    call_command("sync_microsoft_users", graph_api_url=graph_api_url, stdout=out)
+
+    # Assert
+    assert "Users created: 0, updated: 0, deactivated: 0, skipped: 1" in out.getvalue()
+    assert User.objects.count() == 2
+    assert MicrosoftSSOUser.objects.count() == 2
+
+
+def test_sync_microsoft_users_delta(fake_graph, sync_settings):
+    # Arrange
+    graph_api_url, received_requests = fake_graph
+    call_command(
+        "sync_microsoft_users", "--delta", graph_api_url=graph_api_url, stdout=StringIO()
+    )
+    out = StringIO()
+
+    # Act
+    call_command("sync_microsoft_users", "--delta", graph_api_url=graph_api_url, stdout=out)
+
+    # Assert
+    assert "Users created: 0, updated: 1, deactivated: 1, skipped: 0" in out.getvalue()
+    assert received_requests[0]["path"].startswith("/v1.0/users/delta?$select=")
+    assert "$deltatoken=first" in received_requests[1]["path"]
+    assert User.objects.get(username="kalel@dailyplanet.com").last_name == "Kent-Lane"
+    assert User.objects.get(username="lois@dailyplanet.com").is_active is False
+    assert MicrosoftSSOSyncState.objects.get(name="default").delta_link.endswith(
+        "$deltatoken=second"
+    )
+
+
+def test_sync_microsoft_users_delta_expired(fake_graph, sync_settings):
+    # Arrange
+    graph_api_url, received_requests = fake_graph
+    MicrosoftSSOSyncState.objects.create(
+        name="default", delta_link=f"{graph_api_url}/users/delta?$deltatoken=expired"
+    )
+
+    # Act
+    call_command(
+        "sync_microsoft_users", "--delta", graph_api_url=graph_api_url, stdout=StringIO()
+    )
+
+    # Assert
+    assert len(received_requests) == 2
+    assert User.objects.count() == 2
+    assert MicrosoftSSOSyncState.objects.get(name="default").delta_link.endswith(
+        "$deltatoken=first"
+    )
+
+
+def test_command_request_for_domain(settings):
+    # Arrange
+    settings.ALLOWED_HOSTS = ["site.com"]
+
+    # Act
+    request = get_command_request("site.com")
+
+    # Assert
+    assert request.method == "GET"
+    assert request.get_host() == "site.com"
+    assert request.session.session_key is None
+    assert list(request._messages) == []
@@ -1,10 +1,18 @@
+import importlib
+
 import pytest
+from django.conf.urls.i18n import i18n_patterns
+from django.urls import include, path
+from django.utils import translation
 
+from django_microsoft_sso import registry
 from django_microsoft_sso.templatetags.sso_tags import define_sso_providers
 from django_microsoft_sso.utils import adefine_sso_providers
 
 pytestmark = pytest.mark.django_db
 
+urlpatterns = i18n_patterns(path("microsoft_sso/", include("django_microsoft_sso.urls")))
+
 
 def test_tags(client_with_session, settings, callback_request):
 
@@ -55,3 +63,53 @@ async def test_async_view(aclient_with_session, callback_request):
 
     # Assert
     assert "SignWith2" in response_text
+
+
+def test_providers_are_found_once(settings, rf, mocker):
+    # Arrange
+    settings.MICROSOFT_SSO_ENABLED = True
+    import_spy = mocker.spy(importlib, "import_module")
+    reverse_spy = mocker.spy(registry, "reverse")
+    define_sso_providers({"request": rf.get("/login/")})
+
+    # Act
+    sso_providers = define_sso_providers({"request": rf.get("/login/")})
+
+    # Assert
+    microsoft_provider = next(p for p in sso_providers if p["name"] == "microsoft")
+    assert microsoft_provider["login_url"] == "/microsoft_sso/login/"
+    assert import_spy.call_count == 0
+    assert reverse_spy.call_count <= 1
+
+
+def test_providers_are_found_again_on_settings_change(settings, rf):
+    # Arrange
+    settings.MICROSOFT_SSO_ENABLED = True
+    define_sso_providers({"request": rf.get("/login/")})
+
+    # Act
+    settings.STATIC_URL = "/assets/"
+    sso_providers = define_sso_providers({"request": rf.get("/login/")})
+
+    # Assert
+    assert (
+        sso_providers[0]["css_url"] == "/assets/django_microsoft_sso/microsoft_button.css"
+    )
+
+
+def test_provider_urls_use_the_active_language(settings, rf):
+    # Arrange
+    settings.MICROSOFT_SSO_ENABLED = True
+    settings.ROOT_URLCONF = __name__
+    settings.LANGUAGES = [("en", "English"), ("pt-br", "Portuguese")]
+
+    # Act
+    login_urls = []
+    for language in ["en", "pt-br"]:
+        with translation.override(language):
+            sso_providers = define_sso_providers({"request": rf.get("/login/")})
+        microsoft_provider = next(p for p in sso_providers if p["name"] == "microsoft")
+        login_urls.append(microsoft_provider["login_url"])
+
+    # Assert
+    assert login_urls == ["/en/microsoft_sso/login/", "/pt-br/microsoft_sso/login/"]
@@ -2,10 +2,16 @@ import importlib
 from copy import deepcopy
 
 import pytest
+from django.contrib.auth import login
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from django_microsoft_sso import conf
 from django_microsoft_sso.main import UserHelper
+from django_microsoft_sso.models import MicrosoftSSOUser
+from django_microsoft_sso.signals import SUPERUSER_EXISTS_CACHE_KEY
 
 pytestmark = pytest.mark.django_db
 
@@ -233,3 +239,176 @@ def test_duplicated_emails(microsoft_response, callback_request, settings):
     assert user_one.id == user_two.id
     assert user_one.email == user_two.email
     assert User.objects.count() == 1
+
+
+def test_callable_settings_are_resolved_once_per_request(
+    microsoft_response, callback_request, settings, mocker
+):
+    # Arrange
+    get_staff_list = mocker.Mock(return_value=[])
+    settings.MICROSOFT_SSO_STAFF_LIST = get_staff_list
+    settings.MICROSOFT_SSO_ALWAYS_UPDATE_USER_DATA = True
+
+    # Act
+    UserHelper(microsoft_response, callback_request).get_or_create_user()
+    UserHelper(microsoft_response, callback_request).get_or_create_user()
+
+    # Assert
+    get_staff_list.assert_called_once_with(callback_request)
+
+
+@pytest.mark.parametrize("unique_email", [True, False])
+def test_returning_user_query_budget(
+    unique_email, microsoft_response, callback_request, settings
+):
+    # Arrange
+    settings.MICROSOFT_SSO_UNIQUE_EMAIL = unique_email
+    settings.MICROSOFT_SSO_AUTO_CREATE_FIRST_SUPERUSER = False
+    settings.MICROSOFT_SSO_ALWAYS_UPDATE_USER_DATA = False
+    settings.MICROSOFT_SSO_SAVE_BASIC_MICROSOFT_INFO = True
+    UserHelper(deepcopy(microsoft_response), callback_request).get_or_create_user()
+
+    # Act
+    with CaptureQueriesContext(connection) as context:
+        helper = UserHelper(deepcopy(microsoft_response), callback_request)
+        user = helper.get_or_create_user()
+
+    # Assert
+    # Nothing changed: one SELECT for the user and the MicrosoftSSOUser row
+    data_queries = [
+        query["sql"]
+        for query in context.captured_queries
+        if query["sql"].startswith(("SELECT", "INSERT", "UPDATE", "DELETE"))
+    ]
+    assert len(data_queries) == 1
+    assert user.microsoftssouser.microsoft_id == microsoft_response["id"]
+
+
+def test_returning_user_saves_only_changed_fields(
+    microsoft_response, callback_request, settings
+):
+    # Arrange
+    settings.MICROSOFT_SSO_AUTO_CREATE_FIRST_SUPERUSER = False
+    settings.MICROSOFT_SSO_ALWAYS_UPDATE_USER_DATA = True
+    settings.MICROSOFT_SSO_STAFF_LIST = []
+    settings.MICROSOFT_SSO_SUPERUSER_LIST = []
+    UserHelper(deepcopy(microsoft_response), callback_request).get_or_create_user()
+    changed_response = {**deepcopy(microsoft_response), "surname": "Kent-Lane"}
+
+    # Act
+    with CaptureQueriesContext(connection) as context:
+        helper = UserHelper(changed_response, callback_request)
+        user = helper.get_or_create_user()
+
+    # Assert
+    updates = [
+        query["sql"]
+        for query in context.captured_queries
+        if query["sql"].startswith("UPDATE")
+    ]
+    assert helper.user_changed_fields == {"last_name"}
+    assert len(updates) == 1
+    assert '"password"' not in updates[0]
+    assert User.objects.get(pk=user.pk).last_name == "Kent-Lane"
+
+
+def test_find_user_with_mixed_case_username(microsoft_response, callback_request):
+    # Arrange
+    user = User.objects.create(username="KalEl@DailyPlanet.com")
+
+    # Act
+    found_user = UserHelper(microsoft_response, callback_request).find_user()
+
+    # Assert
+    assert found_user == user
+
+
+def test_superuser_exists_is_cached(microsoft_response, callback_request, settings):
+    # Arrange
+    settings.MICROSOFT_SSO_AUTO_CREATE_FIRST_SUPERUSER = True
+    User.objects.create(username="admin", is_superuser=True)
+    helper = UserHelper(microsoft_response, callback_request)
+    assert helper.superuser_exists() is True
+
+    # Act
+    with CaptureQueriesContext(connection) as context:
+        superuser_exists = helper.superuser_exists()
+
+    # Assert
+    assert superuser_exists is True
+    assert len(context.captured_queries) == 0
+
+
+def test_superuser_exists_cache_is_cleared(microsoft_response, callback_request):
+    # Arrange
+    admin = User.objects.create(username="admin", is_superuser=True)
+    helper = UserHelper(microsoft_response, callback_request)
+    assert helper.superuser_exists() is True
+
+    # Act
+    admin.delete()
+
+    # Assert
+    assert helper.superuser_exists() is False
+
+
+def test_superuser_exists_cache_survives_login(microsoft_response, callback_request):
+    # Arrange
+    User.objects.create(username="admin", is_superuser=True)
+    user = User.objects.create(username="kalel@dailyplanet.com")
+    helper = UserHelper(microsoft_response, callback_request)
+    assert helper.superuser_exists() is True
+
+    # Act
+    login(callback_request, user, "django.contrib.auth.backends.ModelBackend")
+
+    # Assert
+    assert cache.get(SUPERUSER_EXISTS_CACHE_KEY) is True
+
+
+@pytest.mark.parametrize("update_fields", [None, ["is_superuser"]])
+def test_superuser_exists_cache_is_cleared_on_demotion(
+    microsoft_response, callback_request, update_fields
+):
+    # Arrange
+    admin = User.objects.create(username="admin", is_superuser=True)
+    assert UserHelper(microsoft_response, callback_request).superuser_exists() is True
+
+    # Act
+    admin.is_superuser = False
+    admin.save(update_fields=update_fields)
+
+    # Assert
+    assert cache.get(SUPERUSER_EXISTS_CACHE_KEY) is None
+
+
+def test_find_user_lookups_use_indexes(microsoft_response, callback_request, settings):
+    # Arrange
+    settings.MICROSOFT_SSO_UNIQUE_EMAIL = False
+    users = User.objects.bulk_create(
+        User(username=f"user{index}@dailyplanet.com", email=f"user{index}@dailyplanet.com")
+        for index in range(5000)
+    )
+    MicrosoftSSOUser.objects.bulk_create(
+        MicrosoftSSOUser(
+            user=user, user_principal_name=user.username, microsoft_id=str(user.pk)
+        )
+        for user in users
+    )
+    response = deepcopy(microsoft_response)
+    response["userPrincipalName"] = "User4321@DailyPlanet.com"
+    helper = UserHelper(response, callback_request)
+
+    # Act
+    user = helper.find_user()
+    # The last lookup, case-insensitive, runs only when these miss
+    plans = [
+        User.objects.filter(**lookup).explain()
+        for lookup in helper.get_find_user_lookups()[:2]
+    ]
+
+    # Assert
+    assert user.username == "user4321@dailyplanet.com"
+    for plan in plans:
+        assert "SCAN" not in plan
+        assert "USING" in plan
@@ -1,12 +1,14 @@
 import pytest
 from django.contrib.auth.backends import ModelBackend
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Permission, User
 from django.contrib.messages import get_messages
 from django.urls import reverse
 
-from django_microsoft_sso import conf
+from django_microsoft_sso import conf, views
 from django_microsoft_sso.main import MicrosoftAuth
+from django_microsoft_sso.models import MicrosoftSSOUser
 from django_microsoft_sso.tests.conftest import SECRET_PATH
+from django_microsoft_sso.tests.test_microsoft_auth import graph_get_side_effect
 
 ROUTE_NAME = "django_microsoft_sso:oauth_callback"
 
@@ -221,3 +223,167 @@ def test_missing_user_login(client_with_session, settings, callback_url):
     assert User.objects.count() == 0
     assert response.url == "/admin/login/"
     assert response.wsgi_request.user.is_authenticated is False
+
+
+@pytest.mark.django_db(transaction=True)
+async def test_async_callback(
+    callback_request_with_state, microsoft_response, mocker, settings
+):
+    # Arrange
+    settings.MICROSOFT_SSO_PRE_VALIDATE_CALLBACK = (
+        "django_microsoft_sso.hooks.pre_validate_user"
+    )
+    settings.MICROSOFT_SSO_PRE_CREATE_CALLBACK = (
+        "django_microsoft_sso.hooks.pre_create_user"
+    )
+    settings.MICROSOFT_SSO_SAVE_ACCESS_TOKEN = False
+    mocker.patch.object(
+        MicrosoftAuth, "aget_user_token", return_value={"access_token": "foo"}
+    )
+    mocker.patch.object(MicrosoftAuth, "aget_user_info", return_value=microsoft_response)
+
+    # Act
+    response = await views.acallback(callback_request_with_state)
+
+    # Assert
+    assert response.status_code == 302
+    assert response.url == SECRET_PATH
+    assert await User.objects.filter(email=microsoft_response["mail"]).aexists()
+
+
+async def test_async_callback_bad_method(rf):
+    # Act
+    response = await views.acallback(rf.post(reverse(ROUTE_NAME)))
+
+    # Assert
+    assert response.status_code == 405
+
+
+async def test_async_get_user_info(callback_request, settings, mocker):
+    # Arrange
+    async def async_get(url, **kwargs):
+        return graph_get_side_effect(url, **kwargs)
+
+    settings.MICROSOFT_SSO_GRAPH_FETCH_MODE = "parallel"
+    mock_client = mocker.patch("django_microsoft_sso.main.get_async_http_client")
+    mock_client.return_value.get.side_effect = async_get
+    ms = MicrosoftAuth(callback_request, token_info={"access_token": "foo"})
+
+    # Act
+    user_info = await ms.aget_user_info()
+
+    # Assert
+    assert user_info["email_verified"] is True
+    assert user_info["picture_raw_data"] == b"picture"
+
+
+@pytest.fixture
+def user_with_picture(django_user_model):
+    user = django_user_model.objects.create(username="kalel@dailyplanet.com")
+    sso_user = MicrosoftSSOUser.objects.create(
+        user=user, picture_raw=b"\x89PNG\r\n\x1a\nfoo", picture_etag='"graph-etag"'
+    )
+    return user, sso_user
+
+
+def test_avatar(client, admin_user, user_with_picture):
+    # Arrange
+    user, sso_user = user_with_picture
+    client.force_login(admin_user)
+
+    # Act
+    response = client.get(sso_user.picture_url)
+
+    # Assert
+    assert sso_user.picture_url.startswith(f"/microsoft_sso/avatar/{user.pk}/?v=")
+    assert response.status_code == 200
+    assert response.content == b"\x89PNG\r\n\x1a\nfoo"
+    assert response["Content-Type"] == "image/png"
+    assert response["ETag"]
+    assert "max-age=31536000" in response["Cache-Control"]
+    assert "immutable" in response["Cache-Control"]
+
+
+def test_avatar_not_modified(client, admin_user, user_with_picture):
+    # Arrange
+    user, _ = user_with_picture
+    client.force_login(admin_user)
+    url = reverse("django_microsoft_sso:avatar", args=[user.pk])
+    etag = client.get(url)["ETag"]
+
+    # Act
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    # Assert
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_avatar_without_etag_not_modified(client, user_with_picture):
+    # Arrange
+    user, sso_user = user_with_picture
+    MicrosoftSSOUser.objects.filter(pk=sso_user.pk).update(picture_etag=None)
+    client.force_login(user)
+    url = reverse("django_microsoft_sso:avatar", args=[user.pk])
+    etag = client.get(url)["ETag"]
+
+    # Act
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    # Assert
+    assert response.status_code == 304
+
+
+def test_avatar_own_picture(client, user_with_picture):
+    # Arrange
+    user, sso_user = user_with_picture
+    client.force_login(user)
+
+    # Act
+    response = client.get(sso_user.picture_url)
+
+    # Assert
+    assert response.status_code == 200
+    assert response.content == b"\x89PNG\r\n\x1a\nfoo"
+
+
+def test_avatar_of_other_user(client, django_user_model, user_with_picture):
+    # Arrange
+    user, _ = user_with_picture
+    other_user = django_user_model.objects.create(username="lois@dailyplanet.com")
+    client.force_login(other_user)
+    url = reverse("django_microsoft_sso:avatar", args=[user.pk])
+
+    # Act
+    response = client.get(url)
+
+    # Assert
+    assert response.status_code == 404
+
+
+def test_avatar_with_view_permission(client, django_user_model, user_with_picture):
+    # Arrange
+    user, _ = user_with_picture
+    other_user = django_user_model.objects.create(username="lois@dailyplanet.com")
+    other_user.user_permissions.add(
+        Permission.objects.get(codename="view_microsoftssouser")
+    )
+    client.force_login(other_user)
+    url = reverse("django_microsoft_sso:avatar", args=[user.pk])
+
+    # Act
+    response = client.get(url)
+
+    # Assert
+    assert response.status_code == 200
+
+
+def test_avatar_requires_login(client, user_with_picture):
+    # Arrange
+    user, _ = user_with_picture
+
+    # Act
+    response = client.get(reverse("django_microsoft_sso:avatar", args=[user.pk]))
+
+    # Assert
+    assert response.status_code == 302
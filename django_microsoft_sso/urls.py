@@ -6,8 +6,18 @@ app_name = "django_microsoft_sso"
 
 urlpatterns = []
 
-if conf.MICROSOFT_SSO_ENABLED:
+if conf.MICROSOFT_SSO_ENABLED and conf.MICROSOFT_SSO_USE_ASYNC_VIEWS:
+    urlpatterns += [
+        path("login/", views.astart_login, name="oauth_start_login"),
+        path("callback/", views.acallback, name="oauth_callback"),
+    ]
+elif conf.MICROSOFT_SSO_ENABLED:
     urlpatterns += [
         path("login/", views.start_login, name="oauth_start_login"),
         path("callback/", views.callback, name="oauth_callback"),
     ]
+
+if conf.MICROSOFT_SSO_ENABLED:
+    urlpatterns += [
+        path("avatar/<int:user_id>/", views.avatar, name="avatar"),
+    ]
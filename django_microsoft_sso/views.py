@@ -1,17 +1,35 @@
-import importlib
+import hashlib
 from urllib.parse import urlparse
 
-import httpx
+from asgiref.sync import sync_to_async
 from django.contrib.auth import login
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import LogoutView
-from django.http import HttpRequest, HttpResponseBase, HttpResponseRedirect
-from django.shortcuts import resolve_url
+from django.http import (
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseBase,
+    HttpResponseNotAllowed,
+    HttpResponseRedirect,
+)
+from django.shortcuts import get_object_or_404, resolve_url
 from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.http import quote_etag
 from django.utils.translation import gettext_lazy as _
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
 from loguru import logger
 
+from django_microsoft_sso.clients import get_http_client
 from django_microsoft_sso.main import MicrosoftAuth, UserHelper
+from django_microsoft_sso.models import MicrosoftSSOUser
+from django_microsoft_sso.pictures import (
+    get_picture_storage,
+    get_picture_version,
+    guess_content_type,
+)
+from django_microsoft_sso.registry import hook_registry
 from django_microsoft_sso.utils import send_message, show_credential
 
 
@@ -31,25 +49,99 @@ def start_login(request: HttpRequest) -> HttpResponseRedirect:
         clean_param = reverse(next_url)
     next_path = urlparse(clean_param).path
 
-    ms_auth = MicrosoftAuth(request)
-    ms_auth.initiate()
+    auth.initiate()
 
     # Save data on Session
     if not request.session.session_key:
         request.session.create()
     timeout = auth.get_sso_value("TIMEOUT")
     request.session.set_expiry(timeout * 60)
-    request.session["msal_graph_info"] = ms_auth.result
+    request.session["msal_graph_info"] = auth.result
     request.session["sso_next_url"] = next_path
     request.session.save()
 
     # Redirect User
-    return HttpResponseRedirect(ms_auth.get_auth_uri())
+    return HttpResponseRedirect(auth.get_auth_uri())
 
 
 @require_http_methods(["GET"])
 def callback(request: HttpRequest) -> HttpResponseRedirect:
     microsoft = MicrosoftAuth(request)
+    login_failed_url, next_url, response = validate_callback(request, microsoft)
+    if response:
+        return response
+
+    # Get Access Token from Microsoft Graph
+    auth_result = microsoft.get_user_token()
+    response = validate_token(request, microsoft, auth_result, login_failed_url)
+    if response:
+        return response
+
+    try:
+        user_result = microsoft.get_user_info()
+    except Exception as error:
+        send_message(request, _(f"Error while processing callback from SSO: {error}."))
+        return HttpResponseRedirect(login_failed_url)
+
+    return login_user(request, microsoft, user_result, next_url, login_failed_url)
+
+
+async def astart_login(request: HttpRequest) -> HttpResponseBase:
+    """Async version of start_login view.
+
+    Building the auth flow and saving the session are not I/O bound
+    after the first login, so we run the sync view in a thread.
+    """
+    return await sync_to_async(start_login)(request)
+
+
+async def acallback(request: HttpRequest) -> HttpResponseBase:
+    """Async version of callback view.
+
+    Calls to Microsoft Graph use the async HTTP Client, so many logins
+    can wait for Microsoft at the same time on a single worker.
+    The token exchange (MSAL has no async API) and the work on session,
+    database and user hooks run in threads.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+
+    microsoft = MicrosoftAuth(request)
+    login_failed_url, next_url, response = await sync_to_async(validate_callback)(
+        request, microsoft
+    )
+    if response:
+        return response
+
+    # Get Access Token from Microsoft Graph
+    auth_result = await microsoft.aget_user_token()
+    response = await sync_to_async(validate_token)(
+        request, microsoft, auth_result, login_failed_url
+    )
+    if response:
+        return response
+
+    try:
+        user_result = await microsoft.aget_user_info()
+    except Exception as error:
+        await sync_to_async(send_message)(
+            request, _(f"Error while processing callback from SSO: {error}.")
+        )
+        return HttpResponseRedirect(login_failed_url)
+
+    return await sync_to_async(login_user)(
+        request, microsoft, user_result, next_url, login_failed_url
+    )
+
+
+def validate_callback(
+    request: HttpRequest, microsoft: MicrosoftAuth
+) -> tuple[str, str, HttpResponseRedirect | None]:
+    """Validate the callback request, before asking for the Access Token.
+
+    :return: The login failed URL, the next URL and, if the request
+        is not valid, the redirect response to return.
+    """
     login_failed_url = reverse(microsoft.get_sso_value("LOGIN_FAILED_URL"))
     code = request.GET.get("code")
     state = request.GET.get("state")
@@ -63,22 +155,29 @@ def callback(request: HttpRequest) -> HttpResponseRedirect:
     enabled, message = microsoft.check_enabled(next_url)
     if not enabled:
         send_message(request, _(message))
-        return HttpResponseRedirect(login_failed_url)
+        return login_failed_url, next_url, HttpResponseRedirect(login_failed_url)
 
     # First, check for authorization code
     if not code:
         send_message(request, _("Authorization Code not received from SSO."))
-        return HttpResponseRedirect(login_failed_url)
+        return login_failed_url, next_url, HttpResponseRedirect(login_failed_url)
 
     # Then, check the state.
     request_state = request.session.get("msal_graph_info", {}).get("state")
 
     if not request_state or state != request_state:
         send_message(request, _("State Mismatch. Time expired?"))
-        return HttpResponseRedirect(login_failed_url)
+        return login_failed_url, next_url, HttpResponseRedirect(login_failed_url)
 
-    # Get Access Token from Microsoft Graph
-    auth_result = microsoft.get_user_token()
+    return login_failed_url, next_url, None
+
+
+def validate_token(
+    request: HttpRequest,
+    microsoft: MicrosoftAuth,
+    auth_result: dict | None,
+    login_failed_url: str,
+) -> HttpResponseRedirect | None:
     if not auth_result:
         send_message(request, _("Access Token not received from SSO."))
         return HttpResponseRedirect(login_failed_url)
@@ -99,21 +198,26 @@ def callback(request: HttpRequest) -> HttpResponseRedirect:
                 f"MICROSOFT_SSO_CLIENT_SECRET: " f"{show_credential(client_secret)}"
             )
         return HttpResponseRedirect(login_failed_url)
+    return None
 
-    try:
-        user_result = microsoft.get_user_info()
-    except Exception as error:
-        send_message(request, _(f"Error while processing callback from SSO: {error}."))
-        return HttpResponseRedirect(login_failed_url)
 
+def login_user(
+    request: HttpRequest,
+    microsoft: MicrosoftAuth,
+    user_result: dict,
+    next_url: str,
+    login_failed_url: str,
+) -> HttpResponseRedirect:
+    """Validate, get or create and login the user from Microsoft Graph data.
+
+    :return: The redirect response to next URL on success,
+        or to login failed URL otherwise.
+    """
     user_helper = UserHelper(user_result, request)
 
     # Run Pre-Validate Callback
-    pre_validate_callback = microsoft.get_sso_value("PRE_VALIDATE_CALLBACK")
-    module_path = ".".join(pre_validate_callback.split(".")[:-1])
-    pre_validate_fn = pre_validate_callback.split(".")[-1]
-    module = importlib.import_module(module_path)
-    user_is_valid = getattr(module, pre_validate_fn)(user_result, request)
+    pre_validate_callback = hook_registry.get_hook("PRE_VALIDATE_CALLBACK", microsoft)
+    user_is_valid = pre_validate_callback(user_result, request)
 
     # Check if User Info is valid to login
     if not user_helper.email_is_valid or not user_is_valid:
@@ -131,11 +235,8 @@ def callback(request: HttpRequest) -> HttpResponseRedirect:
         request.session["microsoft_sso_access_token"] = microsoft.token_info["access_token"]
 
     # Run Pre-Create Callback
-    pre_create_callback = microsoft.get_sso_value("PRE_CREATE_CALLBACK")
-    module_path = ".".join(pre_create_callback.split(".")[:-1])
-    pre_login_fn = pre_create_callback.split(".")[-1]
-    module = importlib.import_module(module_path)
-    extra_users_args = getattr(module, pre_login_fn)(user_result, request)
+    pre_create_callback = hook_registry.get_hook("PRE_CREATE_CALLBACK", microsoft)
+    extra_users_args = pre_create_callback(user_result, request)
 
     # Get or Create User
     auto_create_users = microsoft.get_sso_value("AUTO_CREATE_USERS")
@@ -169,24 +270,13 @@ def callback(request: HttpRequest) -> HttpResponseRedirect:
     request.session.save()
 
     # Run Pre-Login Callback
-    pre_login_callback = microsoft.get_sso_value("PRE_LOGIN_CALLBACK")
-    module_path = ".".join(pre_login_callback.split(".")[:-1])
-    pre_login_fn = pre_login_callback.split(".")[-1]
-    module = importlib.import_module(module_path)
-    getattr(module, pre_login_fn)(user, request)
+    pre_login_callback = hook_registry.get_hook("PRE_LOGIN_CALLBACK", microsoft)
+    pre_login_callback(user, request)
 
     # Get Authentication Backend
-    # If exists, let's make a sanity check on it
+    # If exists, the registry makes a sanity check on it
     # Because Django does not raise errors if backend is wrong
-    auth_backend = microsoft.get_sso_value("AUTHENTICATION_BACKEND")
-    if auth_backend:
-        module_path = ".".join(auth_backend.split(".")[:-1])
-        backend_auth_class = auth_backend.split(".")[-1]
-        try:
-            module = importlib.import_module(module_path)
-            getattr(module, backend_auth_class)
-        except (ImportError, AttributeError) as error:
-            raise ImportError(f"Authentication Backend invalid: {auth_backend}") from error
+    auth_backend = hook_registry.get_backend(microsoft)
 
     # Login User
     login(request, user, auth_backend)
@@ -228,8 +318,88 @@ def microsoft_slo_view(request: HttpRequest) -> HttpResponseBase:
     # Logout from Google (in case you're using both packages)
     token = request.session.get("google_sso_access_token")
     if token:
-        httpx.post(
+        get_http_client().post(
             "https://oauth2.googleapis.com/revoke", params={"token": token}, timeout=10
         )
 
     return LogoutView.as_view(next_page=redirect_url)(request)
+
+
+AVATAR_MAX_AGE = 60 * 60 * 24 * 365
+
+
+def can_view_avatar(request: HttpRequest, user_id: int) -> bool:
+    """Users can see their own picture. Staff can see all pictures."""
+    user = request.user
+    return (
+        user.pk == user_id
+        or user.is_staff
+        or user.has_perm("django_microsoft_sso.view_microsoftssouser")
+    )
+
+
+def get_avatar_version(picture_etag: str | None, picture_raw: bytes | None) -> str:
+    """Get the avatar version, from the picture ETag or, for
+    pictures saved without one, from the picture content."""
+    return get_picture_version(
+        picture_etag or hashlib.sha256(bytes(picture_raw or b"")).hexdigest()
+    )
+
+
+def get_avatar_etag(request: HttpRequest, user_id: int) -> str | None:
+    if not can_view_avatar(request, user_id):
+        return None
+    queryset = MicrosoftSSOUser.objects.filter(user_id=user_id)
+    picture_etag = queryset.values_list("picture_etag", flat=True).first()
+    if picture_etag:
+        return get_picture_version(picture_etag)
+    # Pictures saved without an ETag: the content is the version
+    picture_raw = queryset.values_list("picture_raw", flat=True).first()
+    return get_avatar_version(None, picture_raw) if picture_raw else None
+
+
+@require_http_methods(["GET", "HEAD"])
+@login_required
+@condition(etag_func=get_avatar_etag)
+def avatar(request: HttpRequest, user_id: int) -> HttpResponseBase:
+    """
+    Serve the user picture saved in MicrosoftSSOUser.
+
+    Answers 304 when the browser already has the current picture.
+    Versioned URLs (with the "v" parameter, as in MicrosoftSSOUser.picture_url)
+    can be cached for one year, because a new picture gets a new URL.
+
+    Only the user, staff members and users with the view_microsoftssouser
+    permission can see the picture. Others get a 404, like a missing picture.
+
+    """
+    if not can_view_avatar(request, user_id):
+        raise Http404("User has no picture.")
+    sso_user = get_object_or_404(
+        MicrosoftSSOUser.objects.only(
+            "user_id",
+            "picture_raw",
+            "picture_path",
+            "picture_etag",
+            "picture_content_type",
+        ),
+        user_id=user_id,
+    )
+    if sso_user.picture_path and get_picture_storage() is not None:
+        return HttpResponseRedirect(sso_user.picture_url)
+    if not sso_user.picture_raw:
+        raise Http404("User has no picture.")
+
+    content = bytes(sso_user.picture_raw)
+    response = HttpResponse(
+        content,
+        content_type=sso_user.picture_content_type or guess_content_type(content),
+    )
+    version = get_avatar_version(sso_user.picture_etag, content)
+    if not response.has_header("ETag"):
+        response["ETag"] = quote_etag(version)
+    if request.GET.get("v") == version:
+        patch_cache_control(response, private=True, max_age=AVATAR_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response